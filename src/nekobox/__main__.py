@@ -3,9 +3,10 @@ import shutil
 import asyncio
 import secrets
 from pathlib import Path
+from datetime import timedelta
 from argparse import ArgumentParser
 from configparser import ConfigParser
-from typing import List, Optional, overload
+from typing import Any, Dict, List, Callable, Optional, overload
 
 from creart import it
 from loguru import logger
@@ -29,12 +30,69 @@ ul = "\033[4m"
 bd = "\033[1m"
 
 
-def run(uin: int, host: str, port: int, token: str, path: str, protocol: str, sign_url: str, level: str, use_png: bool):
+def _bool(value: str) -> bool:
+    try:
+        return ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError(f"not a boolean: {value!r}") from None
+
+
+def _seconds(value: str) -> timedelta:
+    return timedelta(seconds=float(value))
+
+
+# 可选的高级配置项, 对应 NekoBoxAdapter 的同名参数; `nekobox gen` 不会询问, 需要时手动写入账号的配置节
+ADVANCED_OPTIONS: Dict[str, Callable[[str], Any]] = {
+    "uid_cache_size": int,
+    "message_cache_size": int,
+    "message_cache_bytes": int,
+    "message_overflow": _bool,
+    "media_concurrency": int,
+    "upload_cache_size": int,
+    "download_max_size": int,
+    "http_pool_size": int,
+    "http_idle_timeout": float,
+    "media_cache_size": int,
+    "audio_cache_size": int,
+    "ffmpeg_concurrency": int,
+    "ffmpeg_timeout": float,
+    "audio_workers": int,
+    "audio_queue_size": int,
+    "event_concurrency": int,
+    "event_queue_size": int,
+    "event_queue_policy": str,
+    "event_backlog_size": int,
+    "event_batch_size": int,
+    "event_batch_window": float,
+    "member_batch_window": float,
+    "member_roster_threshold": int,
+    "forward_mode": str,
+    "forward_max_depth": int,
+    "forward_max_nodes": int,
+    "forward_cache_size": int,
+    "event_journal": _bool,
+    "event_journal_retention": _seconds,
+    "log_diagnose": _bool,
+}
+
+
+def run(
+    uin: int,
+    host: str,
+    port: int,
+    token: str,
+    path: str,
+    protocol: str,
+    sign_url: str,
+    level: str,
+    use_png: bool,
+    options: Dict[str, Any],
+):
     install_loguru()
     loop = it(asyncio.AbstractEventLoop)
     loop.set_exception_handler(loguru_exc_callback_async)
     server = Server(host=host, port=port, path=path, token=token, stream_threshold=4 * 1024 * 1024)
-    server.apply(NekoBoxAdapter(uin, sign_url, protocol, level, use_png, _patch_logging=True))  # type: ignore
+    server.apply(NekoBoxAdapter(uin, sign_url, protocol, level, use_png, _patch_logging=True, **options))  # type: ignore
     server.run()
 
 
@@ -187,8 +245,15 @@ def _run(args):
     path = cfg[uin].get("path", "")
     protocol = cfg[uin]["protocol"]
     level = "DEBUG" if args.debug else cfg[uin]["log_level"]
+    try:
+        options = {
+            key: ADVANCED_OPTIONS[key](value) for key, value in cfg[uin].items() if key in ADVANCED_OPTIONS
+        }
+    except ValueError as e:
+        print(f"账号 {purple}{ul}{uin}{reset} 的高级配置项有误: {e}", file=sys.stderr)
+        return True
     logger.success("读取配置文件完成")
-    run(int(uin), host, port, token, path, protocol, sign_url, level, args.use_png)
+    run(int(uin), host, port, token, path, protocol, sign_url, level, args.use_png, options)
 
 
 def _show(args):
@@ -215,6 +280,9 @@ def _show(args):
     print(f"{green}服务器绑定端口: {reset}{cfg[args.uin]['port']}")
     print(f"{green}服务器部署路径: {reset}{cfg[args.uin].get('path', '')}")
     print(f"{green}默认日志等级:   {reset}{cfg[args.uin]['log_level']}")
+    for key, value in cfg[args.uin].items():
+        if key in ADVANCED_OPTIONS:
+            print(f"{green}{key}: {reset}{value}")
 
 
 def _clear(args):
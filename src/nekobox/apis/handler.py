@@ -1,30 +1,26 @@
-from datetime import datetime, timedelta
+import time
+from copy import copy
+from typing import Optional
+from itertools import islice
 
-from launart import Launart
 from satori.parser import parse
 from loguru import logger as log
 from satori.server import Request, route
 from lagrange.client.client import Client
+from satori.element import Element, Resource
 from lagrange.pb.service.group import FetchGrpRspBody
-from graia.amnesia.builtins.memcache import MemcacheService
-from satori import (
-    User,
-    Guild,
-    Member,
-    Channel,
-    Message,
-    PageResult,
-    ChannelType,
-    MessageObject,
-    transform,
-)
-
-from ..uid import save_uid, resolve_uid
+from satori import User, Guild, Channel, Message, PageResult, ChannelType, MessageObject, transform
+
+from ..uid import resolve_uid
+from ..repository import repo, make_member
 from ..msgid import decode_msgid, encode_msgid
+from ..msgstore import StoredMessage, messages
 from ..transformer import msg_to_satori, satori_to_msg, satori_to_forward_msg
 
 logger = log.patch(lambda r: r.update(name="nekobox.apis"))
 
+MEMBER_PAGE_SIZE = 500
+
 
 def _normalize_forward_attrs(elements) -> None:
     for element in elements:
@@ -37,20 +33,55 @@ def _is_forward_message(element: object) -> bool:
     return isinstance(element, Message) and str(element.forward).lower() == "true"
 
 
+def _strip_inline_resources(element: Element) -> Element:
+    """返回去掉内联资源 (data:, file: 等非 http 地址) 的副本, 避免把整个资源写入消息存储"""
+    strip = isinstance(element, Resource) and not element.src.startswith(("http://", "https://"))
+    if not (strip or element.children):
+        return element
+    element = copy(element)
+    element._attrs = dict(element._attrs)
+    if strip:
+        element.src = ""  # type: ignore
+        if "src" in element._attrs:
+            element._attrs["src"] = ""
+    element._children = [_strip_inline_resources(child) for child in element.children]
+    return element
+
+
+def _remember_sent(client: Client, typ: int, peer: int, seq: int, elements: list, msg_chain: list):
+    messages.of(client).add(
+        StoredMessage(
+            typ,
+            peer,
+            seq,
+            client.uin,
+            client.uid,
+            "",
+            int(time.time()),
+            "".join(getattr(i, "text", "") for i in msg_chain),
+            "".join(str(_strip_inline_resources(i)) for i in elements),
+        )
+    )
+
+
 async def _send_grp_msg_segment(client: Client, elements: list, grp_id: int):
     msg_chain = await satori_to_msg(client, elements, grp_id=grp_id)
     if not msg_chain:
         logger.warning("Empty message after transform, ignore")
         return None
-    return await client.send_grp_msg(msg_chain, grp_id)
+    seq = await client.send_grp_msg(msg_chain, grp_id)
+    _remember_sent(client, 1, grp_id, seq, elements, msg_chain)
+    return seq
 
 
-async def _send_friend_msg_segment(client: Client, elements: list, uid: str):
+async def _send_friend_msg_segment(client: Client, elements: list, uid: str, uin: int):
     msg_chain = await satori_to_msg(client, elements, uid=uid)
     if not msg_chain:
         logger.warning("Empty message after transform, ignore")
         return None
-    return await client.send_friend_msg(msg_chain, uid)
+    seq = await client.send_friend_msg(msg_chain, uid)
+    _remember_sent(client, 2, uin, seq, elements, msg_chain)
+    return seq
 
 
 async def _send_grp_forward_segment(client: Client, element: Message, grp_id: int):
@@ -131,16 +162,13 @@ async def msg_create(client: Client, req: Request[route.MessageParam]):
                 uid = resolve_uid(uin)
             except ValueError:  # Cache miss
                 logger.warning(f"uin {uin} not in cache, fetching from server")
-                friends = await client.get_friend_list()
-                for friend in friends:
-                    if friend.uid:
-                        save_uid(friend.uin, friend.uid)
+                await repo.list_friends(client, force=True)
                 uid = resolve_uid(uin)
             pending = []
             for element in tp:
                 if _is_forward_message(element):
                     if pending:
-                        seq = await _send_friend_msg_segment(client, pending, uid)
+                        seq = await _send_friend_msg_segment(client, pending, uid, uin)
                         if seq is not None:
                             rsp.append(MessageObject.from_elements(str(seq), pending))
                         pending = []
@@ -150,7 +178,7 @@ async def msg_create(client: Client, req: Request[route.MessageParam]):
                 else:
                     pending.append(element)
             if pending:
-                seq = await _send_friend_msg_segment(client, pending, uid)
+                seq = await _send_friend_msg_segment(client, pending, uid, uin)
                 if seq is not None:
                     rsp.append(MessageObject.from_elements(str(seq), pending))
         else:
@@ -173,16 +201,31 @@ async def msg_delete(client: Client, req: Request[route.MessageOpParam]):
 
 
 async def msg_get(client: Client, req: Request[route.MessageOpParam]):
-    typ, grp_id = decode_msgid(req.params["channel_id"])
+    typ, peer = decode_msgid(req.params["channel_id"])
     seq = int(req.params["message_id"])
+    if stored := await messages.of(client).get(typ, peer, seq):
+        return MessageObject(
+            str(seq),
+            stored.content,
+            channel=Channel(
+                req.params["channel_id"],
+                ChannelType.TEXT if typ == 1 else ChannelType.DIRECT,
+                stored.peer_name or None,
+            ),
+            user=User(
+                str(stored.uin),
+                stored.nickname or None,
+                avatar=f"https://q1.qlogo.cn/g?b=qq&nk={stored.uin}&s=640",
+            ),
+        )
     if typ == 1:
-        rsp = (await client.get_grp_msg(grp_id, seq))[0]
+        rsp = (await client.get_grp_msg(peer, seq))[0]
     else:
         raise NotImplementedError(typ)
 
     return MessageObject.from_elements(
         str(rsp),
-        await msg_to_satori(rsp.msg_chain, client.uin, gid=grp_id, client=client),
+        await msg_to_satori(rsp.msg_chain, client.uin, gid=peer, client=client),
         channel=Channel(encode_msgid(1, rsp.grp_id), ChannelType.TEXT, rsp.grp_name),
         user=User(str(rsp.uin), rsp.nickname, avatar=f"https://q1.qlogo.cn/g?b=qq&nk={rsp.uin}&s=640"),
     )
@@ -230,27 +273,15 @@ async def guild_member_mute(client: Client, req: Request[route.GuildMemberMutePa
 
 async def guild_member_list(client: Client, req: Request[route.GuildXXXListParam]):
     grp_id = int(req.params["guild_id"])
-    next_key = req.params.get("next")
+    offset = int(req.params.get("next") or 0)
 
-    rsp = await client.get_grp_members(grp_id, next_key=next_key)
-
-    data = [
-        Member(
-            user=User(
-                id=str(body.account.uin),
-                name=body.nickname,
-                avatar=f"http://thirdqq.qlogo.cn/headimg_dl?dst_uin={body.account.uin}&spec=640",
-            ),
-            nick=body.name.string if body.name else body.nickname,
-            avatar=f"http://thirdqq.qlogo.cn/headimg_dl?dst_uin={body.account.uin}&spec=640",
-            joined_at=datetime.fromtimestamp(body.joined_time),
-        ).dump()
-        for body in rsp.body
-    ]
+    roster = await repo.get_roster(client, grp_id)
+    members = list(islice(roster.values(), offset, offset + MEMBER_PAGE_SIZE))
+    offset += len(members)
 
     return {
-        "data": data,
-        "next": rsp.next_key,
+        "data": [member.dump() for member in members],
+        "next": str(offset) if offset < len(roster) else None,
     }
 
 
@@ -258,59 +289,27 @@ async def guild_member_get(client: Client, req: Request[route.GuildMemberGetPara
     grp_id = int(req.params["guild_id"])
     user_id = int(req.params["user_id"])
 
+    roster = await repo.get_roster(client, grp_id)
+    if member := roster.get(user_id):
+        return [member.dump()]
+
+    # 名单可能尚未同步 (如错过了入群事件)
     try:
         uid = resolve_uid(user_id)
     except ValueError:
-        logger.warning(f"uin {user_id} not in cache, fetching from server")
-        next_key = None
-        uid = None
-        while True:
-            rsp = await client.get_grp_members(grp_id, next_key=next_key)
-            for body in rsp.body:
-                if body.account.uin is not None and body.account.uin == user_id:
-                    save_uid(body.account.uin, body.account.uid)
-                    uid = body.account.uid
-                    break
-            else:
-                if rsp.next_key is not None:
-                    next_key = rsp.next_key.decode()
-            if not uid and not next_key:
-                raise ValueError(f"uin {user_id} not found in {grp_id}")
-            elif uid:
-                break
-
-    rsp = (await client.get_grp_member_info(grp_id, uid)).body[0]
-
-    return [
-        Member(
-            user=User(
-                id=str(rsp.account.uin),
-                name=rsp.nickname,
-                avatar=f"http://thirdqq.qlogo.cn/headimg_dl?dst_uin={rsp.account.uin}&spec=640",
-            ),
-            nick=rsp.name.string if rsp.name else rsp.nickname,
-            avatar=f"http://thirdqq.qlogo.cn/headimg_dl?dst_uin={rsp.account.uin}&spec=640",
-            joined_at=datetime.fromtimestamp(rsp.joined_time),
-        ).dump()
-    ]
+        # uid 未知时只能依赖名单, 强制刷新一次后再判断
+        roster = await repo.get_roster(client, grp_id, force=True)
+        if member := roster.get(user_id):
+            return [member.dump()]
+        raise ValueError(f"uin {user_id} not found in {grp_id}") from None
+    member = make_member((await client.get_grp_member_info(grp_id, uid)).body[0])
+    repo.roster_add(grp_id, user_id, member)
+    return [member.dump()]
 
 
 async def guild_get_list(client: Client, req: Request[route.GuildListParam]) -> PageResult[Guild]:
     _next_key = req.params.get("next")
-    cache = Launart.current().get_component(MemcacheService).cache
-
-    if data := await cache.get("guild_list"):
-        return PageResult(data, None)
-
-    rsp = await client.get_grp_list()
-    data = [
-        Guild(str(i.grp_id), i.info.grp_name, f"https://p.qlogo.cn/gh/{i.grp_id}/{i.grp_id}/640")
-        for i in rsp.grp_list
-    ]
-
-    await cache.set("guild_list", data, timedelta(minutes=5))
-
-    return PageResult(data, None)
+    return PageResult(await repo.list_guilds(client), None)
 
 
 async def friend_channel(client: Client, req: Request[route.UserChannelCreateParam]):
@@ -328,8 +327,9 @@ async def friend_channel(client: Client, req: Request[route.UserChannelCreatePar
 
 
 async def guild_member_req_approve(client: Client, req: Request[route.ApproveParam]):
-    cache = Launart.current().get_component(MemcacheService).cache
-    data: FetchGrpRspBody = await cache.get(f"grp_mbr_req#{req.params['message_id']}")
+    data: Optional[FetchGrpRspBody] = repo.join_requests.peek(int(req.params["message_id"]))
+    if not data:
+        raise ValueError(f"join request {req.params['message_id']} not found or expired")
     await client.set_grp_request(
         data.group.grp_id,
         int(req.params["message_id"]),
@@ -341,23 +341,7 @@ async def guild_member_req_approve(client: Client, req: Request[route.ApprovePar
 
 
 async def friend_list(client: Client, req: Request[route.FriendListParam]):
-    cache = Launart.current().get_component(MemcacheService).cache
-
-    if data := await cache.get("friend_list"):
-        return PageResult(data, None)
-
-    friends = await client.get_friend_list()
-    data = [
-        User(
-            id=str(f.uin),
-            name=f.nickname,
-            avatar=f"http://thirdqq.qlogo.cn/headimg_dl?dst_uin={f.uin}&spec=640",
-        )
-        for f in friends
-    ]
-
-    await cache.set("friend_list", data, timedelta(minutes=5))
-    return PageResult(data, None)
+    return PageResult(await repo.list_friends(client), None)
 
 
 async def _reaction_process(client: Client, req: Request, is_del: bool):
@@ -0,0 +1,181 @@
+import time
+import asyncio
+from datetime import timedelta
+from typing import (
+    TYPE_CHECKING,
+    Set,
+    Dict,
+    List,
+    Tuple,
+    Generic,
+    TypeVar,
+    Callable,
+    Hashable,
+    Iterable,
+    Optional,
+    Awaitable,
+)
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from lagrange.client.client import Client
+
+T = TypeVar("T")
+K = TypeVar("K", bound=Hashable)
+
+
+class SingleFlight(Generic[K, T]):
+    """合并对同一 key 的并发请求, 同一时间只有一个请求在执行"""
+
+    def __init__(self):
+        self._calls: Dict[K, "asyncio.Task[T]"] = {}
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._calls
+
+    def _done(self, key: K, task: "asyncio.Task[T]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def start(self, key: K, func: Callable[[], Awaitable[T]]) -> "asyncio.Task[T]":
+        if (task := self._calls.get(key)) is None:
+            task = asyncio.ensure_future(func())
+            task.add_done_callback(lambda t: self._done(key, t))
+            self._calls[key] = task
+        return task
+
+    async def do(self, key: K, func: Callable[[], Awaitable[T]]) -> T:
+        # shield: 单个等待者被取消时不影响其他等待者
+        return await asyncio.shield(self.start(key, func))
+
+
+class SWRCache(Generic[K, T]):
+    """带 stale-while-revalidate 的加载缓存
+
+    - 未过期: 直接返回
+    - 已过期但未超过 `max_stale`: 返回旧值, 并在后台刷新
+    - 无值或过旧: 等待(合并后的)刷新结果
+    """
+
+    def __init__(self, ttl: timedelta, max_stale: Optional[timedelta] = None):
+        self.ttl = ttl.total_seconds()
+        self.max_stale = max(self.ttl, max_stale.total_seconds()) if max_stale else self.ttl
+        self._values: Dict[K, Tuple[float, T]] = {}
+        # 上次 take_changed 之后写入过的 key
+        self._changed: Set[K] = set()
+        self._flight: SingleFlight[K, T] = SingleFlight()
+        self._background: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def _lookup(self, key: K, max_age: float) -> Optional[T]:
+        entry = self._values.get(key)
+        if entry and time.time() - entry[0] < max_age:
+            return entry[1]
+        return None
+
+    def get_fresh(self, key: K) -> Optional[T]:
+        return self._lookup(key, self.ttl)
+
+    def peek(self, key: K) -> Optional[T]:
+        """返回未超过 `max_stale` 的值, 不触发刷新"""
+        return self._lookup(key, self.max_stale)
+
+    def get_many(self, keys: Iterable[K], allow_stale=False) -> Dict[K, T]:
+        max_age = self.max_stale if allow_stale else self.ttl
+        now = time.time()
+        res = {}
+        for key in keys:
+            entry = self._values.get(key)
+            if entry and now - entry[0] < max_age:
+                res[key] = entry[1]
+        return res
+
+    def put(self, key: K, value: T) -> None:
+        self._values[key] = (time.time(), value)
+        self._changed.add(key)
+
+    def put_many(self, items: Iterable[Tuple[K, T]]) -> None:
+        now = time.time()
+        for key, value in items:
+            self._values[key] = (now, value)
+            self._changed.add(key)
+
+    def invalidate(self, key: K) -> None:
+        self._values.pop(key, None)
+        self._changed.discard(key)
+
+    def entries(self) -> List[Tuple[K, float, T]]:
+        return [(key, stored_at, value) for key, (stored_at, value) in self._values.items()]
+
+    def take_changed(self) -> List[Tuple[K, float, T]]:
+        """返回上次调用之后写入过且仍存在的条目, `load` 载入的条目不计入"""
+        changed, self._changed = self._changed, set()
+        return [(key, *self._values[key]) for key in changed]
+
+    def load(self, entries: Iterable[Tuple[K, float, T]]) -> int:
+        """载入外部快照, 不覆盖更新的值"""
+        count = 0
+        for key, stored_at, value in entries:
+            current = self._values.get(key)
+            if current is None or current[0] < stored_at:
+                self._values[key] = (stored_at, value)
+                count += 1
+        return count
+
+    def purge(self) -> int:
+        deadline = time.time() - self.max_stale
+        expired = [key for key, (stored_at, _) in self._values.items() if stored_at < deadline]
+        for key in expired:
+            del self._values[key]
+        self._changed.difference_update(expired)
+        return len(expired)
+
+    async def _load(self, key: K, loader: Callable[[], Awaitable[T]]) -> T:
+        value = await loader()
+        self.put(key, value)
+        return value
+
+    def _on_background_done(self, key: K, task: asyncio.Task) -> None:
+        self._background.discard(task)
+        if not task.cancelled() and (exc := task.exception()):
+            logger.warning(f"background refresh of {key!r} failed: {exc!r}")
+
+    def revalidate(self, key: K, loader: Callable[[], Awaitable[T]]) -> None:
+        if key not in self._flight:
+            task = self._flight.start(key, lambda: self._load(key, loader))
+            self._background.add(task)
+            task.add_done_callback(lambda t: self._on_background_done(key, t))
+
+    async def get(self, key: K, loader: Callable[[], Awaitable[T]], force=False) -> T:
+        entry = self._values.get(key)
+        if entry and not force:
+            age = time.time() - entry[0]
+            if age < self.ttl:
+                return entry[1]
+            if age < self.max_stale:
+                self.revalidate(key, loader)
+                return entry[1]
+        return await self._flight.do(key, lambda: self._load(key, loader))
+
+
+class PerBot(Generic[T]):
+    """按 bot uin 区分的实例, 由 `NekoBoxAdapter` 创建并绑定
+
+    未绑定的 uin (如登录账号与配置不符时) 按需使用 `factory` 创建
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._instances: Dict[int, T] = {}
+
+    def bind(self, uin: int, instance: T) -> T:
+        self._instances[uin] = instance
+        return instance
+
+    def of(self, client: "Client") -> T:
+        if (instance := self._instances.get(client.uin)) is None:
+            instance = self._instances[client.uin] = self._factory()
+        return instance
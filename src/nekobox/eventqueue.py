@@ -0,0 +1,170 @@
+import asyncio
+from collections import deque
+from dataclasses import field, dataclass
+from typing import Set, Dict, List, Deque, Tuple, Literal, Hashable, Optional, get_args
+
+from loguru import logger
+from satori import EventType
+from satori.server import Event
+
+OverflowPolicy = Literal["block", "drop_oldest", "drop_low_priority"]
+OVERFLOW_POLICIES = get_args(OverflowPolicy)
+
+# 队列满时优先丢弃的事件类型; 登录状态与群信息变更不会重发, 丢弃后消费端状态会出错, 不在此列
+LOW_PRIORITY_EVENTS: Set[str] = {
+    EventType.REACTION_ADDED,
+    EventType.REACTION_REMOVED,
+}
+
+
+def check_policy(policy: str) -> None:
+    if policy not in OVERFLOW_POLICIES:
+        raise ValueError(f"unknown overflow policy: {policy}")
+
+
+def _reaction_key(ev: Event) -> Optional[Tuple[Hashable, ...]]:
+    if not ev._data:
+        return None
+    return (
+        ev.guild.id if ev.guild else None,
+        ev.user.id if ev.user else None,
+        ev._data.get("message_id"),
+        ev._data.get("emoji"),
+    )
+
+
+def coalesce_events(events: List[Event]) -> List[Event]:
+    """合并一批事件中的冗余事件
+
+    - 连续的 login-updated 只保留最后一个, login 对象是共享的, 推送的总是最新状态
+    - 同一用户对同一消息的同一表态先加后减(或先减后加)时两者抵消
+    """
+    kept: List[Optional[Event]] = []
+    reactions: Dict[Tuple[Hashable, ...], int] = {}
+    for ev in events:
+        if (
+            ev.type == EventType.LOGIN_UPDATED
+            and kept
+            and kept[-1]
+            and kept[-1].type == EventType.LOGIN_UPDATED
+        ):
+            kept[-1] = ev
+            continue
+        if ev.type in (EventType.REACTION_ADDED, EventType.REACTION_REMOVED) and (key := _reaction_key(ev)):
+            index = reactions.pop(key, None)
+            if index is not None and kept[index].type != ev.type:  # type: ignore
+                kept[index] = None
+                continue
+            reactions[key] = len(kept)
+        kept.append(ev)
+    return [ev for ev in kept if ev]
+
+
+@dataclass
+class EventQueueStats:
+    high_water: int = 0
+    blocked: int = 0
+    dropped: Dict[str, int] = field(default_factory=dict)
+    batches: int = 0
+    coalesced: int = 0
+
+    @property
+    def total_dropped(self) -> int:
+        return sum(self.dropped.values())
+
+
+class EventQueue:
+    """有界的适配器事件队列
+
+    队列满时按 `policy` 处理:
+    - block: 阻塞生产者直到有空位
+    - drop_oldest: 丢弃最早的事件
+    - drop_low_priority: 丢弃最早的低优先级事件 (如 reaction); 没有可丢弃的事件时,
+      低优先级的新事件直接丢弃, 其余事件阻塞等待
+    """
+
+    def __init__(self, maxsize: int = 10_000, policy: OverflowPolicy = "block"):
+        check_policy(policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.stats = EventQueueStats()
+        self._items: Deque[Event] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def depth(self) -> int:
+        return len(self._items)
+
+    def _drop(self, ev: Event) -> None:
+        typ = getattr(ev.type, "value", ev.type)
+        self.stats.dropped[typ] = self.stats.dropped.get(typ, 0) + 1
+        if self.stats.total_dropped % 100 == 1:  # 避免消费端停滞时刷屏
+            logger.warning(f"event queue full, {self.stats.total_dropped} event(s) dropped so far")
+
+    def _make_room(self, ev: Event) -> bool:
+        """尝试按策略腾出空位; 返回 False 表示新事件本身被丢弃"""
+        if self.policy == "drop_oldest":
+            self._drop(self._items.popleft())
+            return True
+        for index, queued in enumerate(self._items):
+            if queued.type in LOW_PRIORITY_EVENTS:
+                del self._items[index]
+                self._drop(queued)
+                return True
+        if ev.type in LOW_PRIORITY_EVENTS:
+            self._drop(ev)
+            return False
+        return True
+
+    async def put(self, ev: Event) -> None:
+        while self.maxsize > 0 and len(self._items) >= self.maxsize:
+            if self.policy != "block":
+                if not self._make_room(ev):
+                    return
+                if len(self._items) < self.maxsize:
+                    break
+            self.stats.blocked += 1
+            self._not_full.clear()
+            await self._not_full.wait()
+        self._items.append(ev)
+        self.stats.high_water = max(self.stats.high_water, len(self._items))
+        self._not_empty.set()
+
+    async def get(self) -> Event:
+        while not self._items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        ev = self._items.popleft()
+        self._not_full.set()
+        return ev
+
+    async def get_batch(self, max_items: int = 64, window: float = 0.0) -> List[Event]:
+        """取出一批事件并合并其中的冗余事件
+
+        至少等到一个事件; 取完已在队列中的事件后, 若本批只有这一个事件则立即返回, 空闲时不增加延迟,
+        否则说明事件仍在陆续到达, 最多再等待 `window` 秒或直到凑满 `max_items` 个
+        """
+        batch = [await self.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + window
+        while len(batch) < max_items:
+            if self._items:
+                batch.append(self._items.popleft())
+                continue
+            timeout = deadline - loop.time()
+            if len(batch) == 1 or timeout <= 0:
+                break
+            self._not_empty.clear()
+            try:
+                await asyncio.wait_for(self._not_empty.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        self._not_full.set()
+        events = coalesce_events(batch) if len(batch) > 1 else batch
+        self.stats.batches += 1
+        self.stats.coalesced += len(batch) - len(events)
+        return events
@@ -1,6 +1,3 @@
-import asyncio
-
-from satori import Event
 from lagrange.client.client import Client
 from lagrange.client.events.friend import FriendMessage
 from lagrange.client.events.service import ClientOnline, ClientOffline
@@ -11,11 +8,12 @@ from lagrange.client.events.group import (
     GroupMemberQuit,
     GroupNameChanged,
     GroupMemberJoined,
-    GroupMemberJoinedByInvite,
     GroupMemberJoinRequest,
+    GroupMemberJoinedByInvite,
 )
 
-from .utils import event_register, LOGIN_GETTER
+from ..eventqueue import EventQueue
+from .utils import LOGIN_GETTER, dispatcher, event_register
 from .handler import (
     on_grp_msg,
     on_friend_msg,
@@ -29,7 +27,7 @@ from .handler import (
     on_grp_member_request,
 )
 
-__all__ = ["apply_event_handler"]
+__all__ = ["apply_event_handler", "dispatcher"]
 ALL_EVENT_HANDLERS = [
     (GroupMessage, on_grp_msg),
     (FriendMessage, on_friend_msg),
@@ -45,6 +43,6 @@ ALL_EVENT_HANDLERS = [
 ]
 
 
-def apply_event_handler(client: Client, queue: asyncio.Queue[Event], login_getter: LOGIN_GETTER):
+def apply_event_handler(client: Client, queue: EventQueue, login_getter: LOGIN_GETTER):
     for event, ev_handler in ALL_EVENT_HANDLERS:
         event_register(client, queue, event, ev_handler, login_getter)
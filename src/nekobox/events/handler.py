@@ -1,12 +1,10 @@
 import re
+from datetime import datetime
 from typing import Union, Optional
-from datetime import datetime, timedelta
 
-from launart import Launart
 from loguru import logger as log
 from lagrange.client.client import Client
 from lagrange.client.events.friend import FriendMessage
-from graia.amnesia.builtins.memcache import MemcacheService
 from lagrange.client.events.service import ClientOnline, ClientOffline
 from satori import (
     User,
@@ -33,7 +31,9 @@ from lagrange.client.events.group import (
 
 from ..msgid import encode_msgid
 from ..transformer import msg_to_satori
+from ..msgstore import StoredMessage, messages
 from ..uid import save_uid, resolve_uid, resolve_uin
+from ..repository import repo, make_guild, member_lookup
 
 logger = log.patch(lambda r: r.update(name="nekobox.events"))
 
@@ -49,11 +49,54 @@ def escape_tag(s: str) -> str:
     return re.sub(r"</?((?:[fb]g\s)?[^<>\s]*)>", r"\\\g<0>", s)
 
 
+async def _fetch_member(client: Client, grp_id: int, uin: int, uid: str) -> Member:
+    info = await member_lookup.get(client, grp_id, uid)
+    user = User(
+        str(uin),
+        info.nickname,
+        info.name.string if info.name else None,
+        avatar=f"https://q1.qlogo.cn/g?b=qq&nk={uin}&s=640",
+    )
+    return Member(user, info.name.string if info.name else info.nickname, avatar=user.avatar)
+
+
+async def _fetch_operator(client: Client, grp_id: int, uin: int, uid: str) -> Member:
+    info = await member_lookup.get(client, grp_id, uid)
+    info1 = await client.get_user_info(uid)
+    return Member(
+        User(
+            str(uin),
+            info1.name,
+            info.nickname,
+            avatar=f"https://q1.qlogo.cn/g?b=qq&nk={uin}&s=640",
+        ),
+        info.name.string if info.name else info.nickname,
+        avatar=f"https://q1.qlogo.cn/g?b=qq&nk={uin}&s=640",
+    )
+
+
 async def on_grp_msg(client: Client, event: GroupMessage, login: Login) -> Optional[Event]:
     save_uid(event.uin, event.uid)
     content = await msg_to_satori(event.msg_chain, client.uin, gid=event.grp_id, client=client)
     msg = "".join(str(i) for i in content)
-    logger.info(f"[message-created] {event.nickname}({event.uin})@{event.grp_id}: {escape_tag(msg)!r}")
+    messages.of(client).add(
+        StoredMessage(
+            1,
+            event.grp_id,
+            event.seq,
+            event.uin,
+            event.uid,
+            event.nickname,
+            event.time,
+            event.msg,
+            msg,
+            event.grp_name,
+        )
+    )
+    # 仅在 INFO 可用时才渲染消息摘要
+    logger.opt(lazy=True).info(
+        "{}", lambda: f"[message-created] {event.nickname}({event.uin})@{event.grp_id}: {escape_tag(msg)!r}"
+    )
     usr = User(
         str(event.uin),
         event.nickname,
@@ -65,11 +108,9 @@ async def on_grp_msg(client: Client, event: GroupMessage, login: Login) -> Optio
         str(event.grp_id), event.grp_name, f"https://p.qlogo.cn/gh/{event.grp_id}/{event.grp_id}/640"
     )
     member = Member(usr, event.nickname, avatar=usr.avatar)
-    cache = Launart.current().get_component(MemcacheService).cache
-    await cache.set(f"guild@{guild.id}", guild, timedelta(minutes=5))
-    await cache.set(f"channel@{channel.id}", channel, timedelta(minutes=5))
-    await cache.set(f"user@{usr.id}", usr, timedelta(minutes=5))
-    await cache.set(f"member@{guild.id}#{usr.id}", member, timedelta(minutes=5))
+    repo.put_guild(guild, channel)
+    repo.users.put(event.uin, usr)
+    repo.members.put((event.grp_id, event.uin), member)
     return Event(
         EventType.MESSAGE_CREATED,
         datetime.fromtimestamp(event.time),
@@ -84,40 +125,14 @@ async def on_grp_msg(client: Client, event: GroupMessage, login: Login) -> Optio
 
 async def on_grp_recall(client: Client, event: GroupRecall, login: Login) -> Optional[Event]:
     uin = resolve_uin(event.uid)
-    cache = Launart.current().get_component(MemcacheService).cache
-    usr = await cache.get(f"user@{uin}")
-    guild = await cache.get(f"guild@{event.grp_id}")
-    channel = await cache.get(f"channel@{encode_msgid(1, event.grp_id)}")
-    member = await cache.get(f"member@{event.grp_id}#{uin}")
-    if not usr or not member:
-        info = (await client.get_grp_member_info(event.grp_id, event.uid)).body[0]
-        usr = User(
-            str(uin),
-            info.nickname,
-            info.name.string if info.name else None,
-            avatar=f"https://q1.qlogo.cn/g?b=qq&nk={uin}&s=640",
-        )
-        member = Member(usr, info.name.string if info.name else info.nickname, avatar=usr.avatar)
-        await cache.set(f"user@{uin}", usr, timedelta(minutes=5))
-        await cache.set(f"member@{event.grp_id}#{uin}", member, timedelta(minutes=5))
-    if not guild or not channel:
-        grp_list = (await client.get_grp_list()).grp_list
-        for g in grp_list:
-            _guild = Guild(str(g.grp_id), g.info.grp_name, f"https://p.qlogo.cn/gh/{g.grp_id}/{g.grp_id}/640")
-            _channel = Channel(encode_msgid(1, g.grp_id), ChannelType.TEXT, g.info.grp_name)
-            await cache.set(f"guild@{g.grp_id}", _guild, timedelta(minutes=5))
-            await cache.set(f"channel@{_channel.id}", _channel, timedelta(minutes=5))
-            if _guild.id == str(event.grp_id):
-                guild = _guild
-                channel = _channel
-        if not guild or not channel:
-            guild = Guild(
-                str(event.grp_id),
-                str(event.grp_id),
-                f"https://p.qlogo.cn/gh/{event.grp_id}/{event.grp_id}/640",
-            )
-            channel = Channel(encode_msgid(1, event.grp_id), ChannelType.TEXT, str(event.grp_id))
+    member = await repo.get_member(
+        event.grp_id, uin, lambda: _fetch_member(client, event.grp_id, uin, event.uid)
+    )
+    usr = member.user
+    guild = await repo.get_guild(client, event.grp_id)
+    channel = await repo.get_channel(client, event.grp_id)
 
+    origin = await messages.of(client).get(1, event.grp_id, event.seq)
     logger.info(f"[message-deleted] {usr.nick}({usr.id})@{guild.id}: {event.seq}")
     return Event(
         EventType.MESSAGE_DELETED,
@@ -127,7 +142,7 @@ async def on_grp_recall(client: Client, event: GroupRecall, login: Login) -> Opt
         guild=guild,
         user=usr,
         member=member,
-        message=MessageObject(str(event.seq), event.suffix),
+        message=MessageObject(str(event.seq), origin.content if origin else event.suffix),
     )
 
 
@@ -135,26 +150,29 @@ async def on_friend_msg(client: Client, event: FriendMessage, login: Login) -> O
     save_uid(event.from_uin, event.from_uid)
     content = await msg_to_satori(event.msg_chain, client.uin, uid=event.from_uid, client=client)
     msg = "".join(str(i) for i in content)
-    cache = Launart.current().get_component(MemcacheService).cache
-    user = await cache.get(f"user@{event.from_uin}")
-    if not user:
-        frd_list = await client.get_friend_list()
-        for frd in frd_list:
-            _user = User(
-                str(frd.uin),
-                frd.nickname,
-                frd.remark,
-                avatar=f"https://q1.qlogo.cn/g?b=qq&nk={frd.uin}&s=640",
-            )
-            await cache.set(f"user@{frd.uin}", _user, timedelta(minutes=5))
-            if frd.uin == event.from_uin:
-                user = _user
+    user = await repo.get_friend(client, event.from_uin)
     if not user:
         info = await client.get_user_info(event.from_uid)
         user = User(
             str(event.from_uin), info.name, avatar=f"https://q1.qlogo.cn/g?b=qq&nk={event.from_uin}&s=640"
         )
-    logger.info(f"[message-created] {user.nick or user.name}({user.id}): {escape_tag(msg)!r}")
+        repo.users.put(event.from_uin, user)
+    messages.of(client).add(
+        StoredMessage(
+            2,
+            event.from_uin,
+            event.seq,
+            event.from_uin,
+            event.from_uid,
+            user.nick or user.name or "",
+            event.timestamp,
+            event.msg,
+            msg,
+        )
+    )
+    logger.opt(lazy=True).info(
+        "{}", lambda: f"[message-created] {user.nick or user.name}({user.id}): {escape_tag(msg)!r}"
+    )
     return Event(
         EventType.MESSAGE_CREATED,
         datetime.fromtimestamp(event.timestamp),
@@ -187,26 +205,13 @@ async def on_client_offline(client: Client, event: ClientOffline, login: Login)
 
 async def on_grp_name_changed(client: Client, event: GroupNameChanged, login: Login) -> Event:
     operator_id = resolve_uin(event.operator_uid)
-    cache = Launart.current().get_component(MemcacheService).cache
-    guild = Guild(
-        str(event.grp_id), event.name_new, f"https://p.qlogo.cn/gh/{event.grp_id}/{event.grp_id}/640"
+    guild = make_guild(event.grp_id, event.name_new)
+    repo.put_guild(guild)
+    operator = await repo.get_member(
+        event.grp_id,
+        operator_id,
+        lambda: _fetch_operator(client, event.grp_id, operator_id, event.operator_uid),
     )
-    await cache.set(f"guild@{guild.id}", guild, timedelta(minutes=5))
-    operator = await cache.get(f"member@{event.grp_id}#{operator_id}")
-    if not operator:
-        info = (await client.get_grp_member_info(event.grp_id, event.operator_uid)).body[0]
-        info1 = await client.get_user_info(event.operator_uid)
-        operator = Member(
-            User(
-                str(operator_id),
-                info1.name,
-                info.nickname,
-                avatar=f"https://q1.qlogo.cn/g?b=qq&nk={operator_id}&s=640",
-            ),
-            info.name.string if info.name else info.nickname,
-            avatar=f"https://q1.qlogo.cn/g?b=qq&nk={operator_id}&s=640",
-        )
-        await cache.set(f"member@{event.grp_id}#{operator_id}", operator, timedelta(minutes=5))
     logger.info(f"[guild-updated] {operator.nick} changed the group name to {event.name_new}")
     return Event(
         EventType.GUILD_UPDATED,
@@ -223,7 +228,6 @@ async def on_grp_name_changed(client: Client, event: GroupNameChanged, login: Lo
 async def on_member_joined(
     client: Client, event: Union[GroupMemberJoined, GroupMemberJoinedByInvite], login: Login
 ) -> Event:
-    cache = Launart.current().get_component(MemcacheService).cache
     try:
         if isinstance(event, GroupMemberJoined):
             uid = event.uid
@@ -231,34 +235,15 @@ async def on_member_joined(
         else:
             uin = event.uin
             uid = resolve_uid(event.uin)
-        member = await cache.get(f"member@{event.grp_id}#{uin}")
-        if not member:
-            info = (await client.get_grp_member_info(event.grp_id, uid)).body[0]
-            user = User(str(uin), info.nickname, avatar=f"https://q1.qlogo.cn/g?b=qq&nk={uin}&s=640")
-            member = Member(
-                user,
-                info.name.string if info.name else info.nickname,
-                avatar=f"https://q1.qlogo.cn/g?b=qq&nk={uin}&s=640",
-            )
-            await cache.set(f"member@{event.grp_id}#{uin}", member, timedelta(minutes=5))
+        member = await repo.get_member(
+            event.grp_id, uin, lambda: _fetch_member(client, event.grp_id, uin, uid)
+        )
+        repo.roster_add(event.grp_id, uin, member)
     except ValueError:
         uin = str(getattr(event, "uin", getattr(event, "uid", "0")))
         user = User(uin, uin, avatar=f"https://q1.qlogo.cn/g?b=qq&nk={uin}&s=640")
         member = Member(user, user.name, avatar=user.avatar)
-    guild = await cache.get(f"guild@{event.grp_id}")
-    if not guild:
-        grp_list = (await client.get_grp_list()).grp_list
-        for g in grp_list:
-            _guild = Guild(str(g.grp_id), g.info.grp_name, f"https://p.qlogo.cn/gh/{g.grp_id}/{g.grp_id}/640")
-            await cache.set(f"guild@{g.grp_id}", _guild, timedelta(minutes=5))
-            if _guild.id == str(event.grp_id):
-                guild = _guild
-        if not guild:
-            guild = Guild(
-                str(event.grp_id),
-                str(event.grp_id),
-                f"https://p.qlogo.cn/gh/{event.grp_id}/{event.grp_id}/640",
-            )
+    guild = await repo.get_guild(client, event.grp_id)
     logger.info(f"[guild-member-added] {member.nick}({uin}) joined {guild.name}({guild.id})")
     return Event(
         EventType.GUILD_MEMBER_ADDED,
@@ -271,49 +256,19 @@ async def on_member_joined(
 
 
 async def on_member_quit(client: Client, event: GroupMemberQuit, login: Login) -> Optional[Event]:
-    cache = Launart.current().get_component(MemcacheService).cache
-    member = await cache.get(f"member@{event.grp_id}#{event.uin}")
-    if not member:
-        info = (await client.get_grp_member_info(event.grp_id, event.uid)).body[0]
-        user = User(str(event.uin), info.nickname, avatar=f"https://q1.qlogo.cn/g?b=qq&nk={event.uin}&s=640")
-        member = Member(
-            user,
-            info.name.string if info.name else info.nickname,
-            avatar=f"https://q1.qlogo.cn/g?b=qq&nk={event.uin}&s=640",
-        )
-        await cache.set(f"member@{event.grp_id}#{event.uin}", member, timedelta(minutes=5))
-    guild = await cache.get(f"guild@{event.grp_id}")
-    if not guild:
-        grp_list = (await client.get_grp_list()).grp_list
-        for g in grp_list:
-            _guild = Guild(str(g.grp_id), g.info.grp_name, f"https://p.qlogo.cn/gh/{g.grp_id}/{g.grp_id}/640")
-            await cache.set(f"guild@{g.grp_id}", _guild, timedelta(minutes=5))
-            if _guild.id == str(event.grp_id):
-                guild = _guild
-        if not guild:
-            guild = Guild(
-                str(event.grp_id),
-                str(event.grp_id),
-                f"https://p.qlogo.cn/gh/{event.grp_id}/{event.grp_id}/640",
-            )
+    member = await repo.get_member(
+        event.grp_id, event.uin, lambda: _fetch_member(client, event.grp_id, event.uin, event.uid)
+    )
+    guild = await repo.get_guild(client, event.grp_id)
     operator = None
     if event.is_kicked and event.operator_uid:
         operator_id = resolve_uin(event.operator_uid)
-        operator = await cache.get(f"member@{event.grp_id}#{operator_id}")
-        if not operator:
-            info = (await client.get_grp_member_info(event.grp_id, event.operator_uid)).body[0]
-            info1 = await client.get_user_info(event.operator_uid)
-            operator = Member(
-                User(
-                    str(operator_id),
-                    info1.name,
-                    info.nickname,
-                    avatar=f"https://q1.qlogo.cn/g?b=qq&nk={operator_id}&s=640",
-                ),
-                info.name.string if info.name else info.nickname,
-                avatar=f"https://q1.qlogo.cn/g?b=qq&nk={operator_id}&s=640",
-            )
-            await cache.set(f"member@{event.grp_id}#{operator_id}", operator, timedelta(minutes=5))
+        operator = await repo.get_member(
+            event.grp_id,
+            operator_id,
+            lambda: _fetch_operator(client, event.grp_id, operator_id, event.operator_uid),
+        )
+    repo.roster_remove(event.grp_id, event.uin)
     logger.info(
         f"[guild-member-removed] {member.nick}({event.uin}) left {guild.name}({guild.id}) "
         f"{f'by {operator.nick}({operator.user.id})' if operator else ''}"  # type: ignore
@@ -338,15 +293,12 @@ async def on_grp_member_request(
             break
     else:
         return
-    cache = Launart.current().get_component(MemcacheService).cache
-    await cache.set(f"grp_mbr_req#{req.seq}", req, timedelta(minutes=30))
+    repo.join_requests.put(req.seq, req)
     user_id = resolve_uin(event.uid)
     user = User(str(user_id), req.target.name, avatar=f"https://q1.qlogo.cn/g?b=qq&nk={user_id}&s=640")
-    await cache.set(f"user@{user_id}", user, timedelta(minutes=5))
-    guild = Guild(
-        str(event.grp_id), req.group.grp_name, f"https://p.qlogo.cn/gh/{event.grp_id}/{event.grp_id}/640"
-    )
-    await cache.set(f"guild@{event.grp_id}", guild, timedelta(minutes=5))
+    repo.users.put(user_id, user)
+    guild = make_guild(event.grp_id, req.group.grp_name)
+    repo.put_guild(guild)
     logger.info(f"[guild-member-request] {user.nick}({user.id}) requested to join {guild.name}({guild.id})")
     return Event(
         EventType.GUILD_MEMBER_REQUEST,
@@ -367,31 +319,10 @@ async def on_grp_reaction(client: Client, event: GroupReaction, login: Login) ->
     else:
         emoji = f"face:{event.emoji_id}"
 
-    cache = Launart.current().get_component(MemcacheService).cache
-    member = await cache.get(f"member@{event.grp_id}#{user_id}")
-    if not member:
-        info = (await client.get_grp_member_info(event.grp_id, event.uid)).body[0]
-        user = User(str(user_id), info.nickname, avatar=f"https://q1.qlogo.cn/g?b=qq&nk={user_id}&s=640")
-        member = Member(
-            user,
-            info.name.string if info.name else info.nickname,
-            avatar=f"https://q1.qlogo.cn/g?b=qq&nk={user_id}&s=640",
-        )
-        await cache.set(f"member@{event.grp_id}#{user_id}", member, timedelta(minutes=5))
-    guild = await cache.get(f"guild@{event.grp_id}")
-    if not guild:
-        grp_list = (await client.get_grp_list()).grp_list
-        for g in grp_list:
-            _guild = Guild(str(g.grp_id), g.info.grp_name, f"https://p.qlogo.cn/gh/{g.grp_id}/{g.grp_id}/640")
-            await cache.set(f"guild@{g.grp_id}", _guild, timedelta(minutes=5))
-            if _guild.id == str(event.grp_id):
-                guild = _guild
-        if not guild:
-            guild = Guild(
-                str(event.grp_id),
-                str(event.grp_id),
-                f"https://p.qlogo.cn/gh/{event.grp_id}/{event.grp_id}/640",
-            )
+    member = await repo.get_member(
+        event.grp_id, user_id, lambda: _fetch_member(client, event.grp_id, user_id, event.uid)
+    )
+    guild = await repo.get_guild(client, event.grp_id)
     if event.is_increase:
         action = "added"
     else:
@@ -1,28 +1,168 @@
+import time
 import asyncio
-from typing import Type, TypeVar, Callable, Optional, Coroutine
+from collections import deque, defaultdict
+from typing import Set, Dict, Type, Deque, Tuple, TypeVar, Callable, Hashable, Optional, Awaitable, Coroutine
 
 from loguru import logger
-from satori import EventType, Login
 from satori.server import Event
+from satori import Login, EventType
 from lagrange.client.client import Client
 from lagrange.client.events import BaseEvent
+from lagrange.client.events.group import GroupReaction
+
+from ..utils import TimingStats
+from ..eventqueue import EventQueue, OverflowPolicy, check_policy
 
 TEvent = TypeVar("TEvent", bound=BaseEvent)
 LOGIN_GETTER = Callable[[], Login]
 
+# 产生 eventqueue.LOW_PRIORITY_EVENTS 的 lagrange 事件, 积压时优先丢弃
+LOW_PRIORITY_SOURCES = (GroupReaction,)
+
+
+# (handler 名, 是否低优先级, 产生事件的 job, 投递事件的回调)
+_Job = Tuple[str, bool, Callable[[], Awaitable[Optional[Event]]], Callable[[Event], Awaitable[None]]]
+
+
+class EventDispatcher:
+    """按频道(群/好友)排队处理事件
+
+    同一频道内按到达顺序串行处理, 不同频道并行, 同时运行的 handler 数受 `concurrency` 限制;
+    handler 结束并释放并发额度后才投递事件, 事件队列满时只阻塞该频道
+
+    lagrange 无法被反压, 积压的事件总数达到 `max_pending` 时在提交时按 `policy` 丢弃:
+    - drop_oldest: 丢弃该频道最早的等待中的事件, 没有时丢弃新事件
+    - drop_low_priority: 丢弃该频道最早的低优先级事件, 没有时丢弃新事件
+    - block: 无法阻塞 lagrange, 丢弃新事件
+    """
+
+    def __init__(self, concurrency: int = 16, max_pending: int = 10_000, policy: OverflowPolicy = "block"):
+        check_policy(policy)
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.policy = policy
+        self.stats: Dict[str, TimingStats] = defaultdict(TimingStats)
+        self.dropped: Dict[str, int] = {}
+        self._pending = 0
+        self._sem = asyncio.Semaphore(concurrency)
+        self._channels: Dict[Hashable, Deque[_Job]] = {}
+        self._workers: Set[asyncio.Task] = set()
+
+    def configure(
+        self, concurrency: int, max_pending: Optional[int] = None, policy: Optional[OverflowPolicy] = None
+    ) -> None:
+        self.concurrency = concurrency
+        self._sem = asyncio.Semaphore(concurrency)
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if policy is not None:
+            check_policy(policy)
+            self.policy = policy
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @staticmethod
+    def channel_of(event: BaseEvent) -> Hashable:
+        if (grp_id := getattr(event, "grp_id", None)) is not None:
+            return "grp", grp_id
+        if (uin := getattr(event, "from_uin", None)) is not None:
+            return "friend", uin
+        return "client", 0
+
+    def _drop(self, name: str) -> None:
+        self.dropped[name] = self.dropped.get(name, 0) + 1
+        total = sum(self.dropped.values())
+        if total % 100 == 1:  # 避免持续积压时刷屏
+            logger.warning(f"event backlog full, {total} event(s) dropped so far")
+
+    def _make_room(self, jobs: Optional[Deque[_Job]]) -> bool:
+        """按策略腾出一个位置; 返回 False 表示新事件本身被丢弃"""
+        if jobs and self.policy != "block":
+            # 队首的 job 可能正在运行, 不能丢弃
+            for index in range(1, len(jobs)):
+                if self.policy == "drop_oldest" or jobs[index][1]:
+                    name = jobs[index][0]
+                    del jobs[index]
+                    self._pending -= 1
+                    self._drop(name)
+                    return True
+        return False
+
+    def submit(
+        self,
+        channel: Hashable,
+        name: str,
+        job: Callable[[], Awaitable[Optional[Event]]],
+        deliver: Callable[[Event], Awaitable[None]],
+        low_priority: bool = False,
+    ) -> bool:
+        jobs = self._channels.get(channel)
+        if self.max_pending > 0 and self._pending >= self.max_pending and not self._make_room(jobs):
+            self._drop(name)
+            return False
+        self._pending += 1
+        if jobs is not None:
+            jobs.append((name, low_priority, job, deliver))
+            return True
+        self._channels[channel] = deque([(name, low_priority, job, deliver)])
+        worker = asyncio.create_task(self._drain(channel))
+        self._workers.add(worker)
+        worker.add_done_callback(self._workers.discard)
+        return True
+
+    async def _drain(self, channel: Hashable) -> None:
+        jobs = self._channels[channel]
+        try:
+            while jobs:
+                name, _, job, deliver = jobs[0]
+                ev = None
+                async with self._sem:
+                    start = time.perf_counter()
+                    try:
+                        ev = await job()
+                    except Exception as e:
+                        logger.exception(f"Unhandled exception on {name}", exc_info=e)
+                    finally:
+                        elapsed = time.perf_counter() - start
+                        self.stats[name].record(elapsed)
+                        logger.trace(f"{name} handled in {elapsed * 1000:.1f}ms")
+                if ev is not None:
+                    # 在并发额度之外投递, 队列满时只阻塞本频道
+                    await deliver(ev)
+                jobs.popleft()
+                self._pending -= 1
+        finally:
+            self._pending -= len(jobs)
+            del self._channels[channel]
+
+
+dispatcher = EventDispatcher()
+
 
 def event_register(
     client: Client,
-    queue: asyncio.Queue[Event],
+    queue: EventQueue,
     event_type: Type[TEvent],
     handler: Callable[["Client", TEvent, Login], Coroutine[None, None, Optional[Event]]],
     login_getter: LOGIN_GETTER,
 ):
-    async def _after_handle(_client: Client, event: TEvent):
+    low_priority = issubclass(event_type, LOW_PRIORITY_SOURCES)
+
+    async def _handle(_client: Client, event: TEvent) -> Optional[Event]:
         ev = await handler(_client, event, login_getter())
-        if ev:
-            if ev.type != EventType.MESSAGE_CREATED:
-                logger.trace(f"Event '{ev.type}' was triggered")
-            await queue.put(ev)
+        if ev and ev.type != EventType.MESSAGE_CREATED:
+            logger.trace(f"Event '{ev.type}' was triggered")
+        return ev
+
+    async def _after_handle(_client: Client, event: TEvent):
+        dispatcher.submit(
+            dispatcher.channel_of(event),
+            event_type.__name__,
+            lambda: _handle(_client, event),
+            queue.put,
+            low_priority,
+        )
 
     client.events.subscribe(event_type, handler=_after_handle)
@@ -0,0 +1,176 @@
+import json
+import time
+import asyncio
+from pathlib import Path
+from collections import deque
+from datetime import timedelta
+from typing import TYPE_CHECKING, Set, List, Deque, Tuple, Iterable, Iterator, Optional
+
+from loguru import logger
+from satori.server import Event
+from satori import __version__ as satori_version
+
+if TYPE_CHECKING:
+    from satori.server import Server
+
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class EventJournal:
+    """追加写入的事件日志, 分段存放于 `bots/<uin>/events/`, sn 在重启后继续递增
+
+    实现 satori `Server` 事件缓存的 `append`/`after` 接口, 消费端带 sequence 重连时
+    先从内存中的尾部补发, 不足时再读取磁盘
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        segment_size: int = 4 * 1024 * 1024,
+        retention: timedelta = timedelta(days=1),
+        tail_size: int = 1000,
+    ):
+        self.root = root
+        self.segment_size = segment_size
+        self.retention = retention.total_seconds()
+        self.next_sn = 0
+        self._tail: Deque[Event] = deque(maxlen=tail_size)
+        self._pending: List[Tuple[int, str]] = []
+        self._segment: Optional[Path] = None
+        self._written = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    def _segments(self) -> List[Tuple[int, Path]]:
+        segments = []
+        for path in self.root.glob(f"*{SEGMENT_SUFFIX}"):
+            try:
+                segments.append((int(path.stem), path))
+            except ValueError:
+                continue
+        return sorted(segments)
+
+    def _purge(self) -> int:
+        """删除超出保留时间的分段, 当前写入的分段始终保留"""
+        expire = time.time() - self.retention
+        removed = 0
+        for _, path in self._segments()[:-1]:
+            if path != self._segment and path.stat().st_mtime < expire:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    @staticmethod
+    def _last_sn(path: Path) -> Optional[int]:
+        # 崩溃时最后一行可能不完整, 从后向前找到第一条可解析的记录
+        for line in reversed(path.read_text("utf-8").splitlines()):
+            try:
+                return int(json.loads(line)["sn"])
+            except (ValueError, KeyError, TypeError):
+                continue
+        return None
+
+    def _open(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._purge()
+        for first, path in reversed(self._segments()):
+            last = self._last_sn(path)
+            if last is not None:
+                self.next_sn = max(self.next_sn, last + 1)
+                break
+            self.next_sn = max(self.next_sn, first)
+
+    async def open(self) -> None:
+        await asyncio.to_thread(self._open)
+        logger.debug(f"event journal resumed at sn {self.next_sn}")
+
+    def attach(self, server: "Server") -> None:
+        """接管 server 的事件序号与重连补发缓存
+
+        依赖 satori `Server` 的私有属性 `_sequence` 与 `_event_cache`, 缺失时直接报错
+        """
+        cache = getattr(server, "_event_cache", None)
+        if not isinstance(getattr(server, "_sequence", None), int) or not hasattr(cache, "after"):
+            raise RuntimeError(
+                f"satori {satori_version} Server has no _sequence/_event_cache, "
+                "event journal cannot be attached"
+            )
+        server._sequence = max(server._sequence, self.next_sn)
+        server._event_cache = self  # type: ignore
+
+    def append(self, event: Event) -> None:
+        self.next_sn = event.sn + 1
+        self._tail.append(event)
+        self._pending.append((event.sn, json.dumps(event.dump(), ensure_ascii=False)))
+        if len(self._pending) == 1:
+            task = asyncio.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _write(self, batch: List[Tuple[int, str]]) -> None:
+        start = 0
+        while start < len(batch):
+            if self._segment is None or self._written >= self.segment_size:
+                self._segment = self.root / f"{batch[start][0]:012d}{SEGMENT_SUFFIX}"
+                self._written = 0
+                self._purge()
+            lines = []
+            while start < len(batch) and self._written < self.segment_size:
+                line = f"{batch[start][1]}\n".encode()
+                lines.append(line)
+                self._written += len(line)
+                start += 1
+            with self._segment.open("ab") as f:
+                f.write(b"".join(lines))
+
+    async def flush(self) -> None:
+        async with self._lock:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await asyncio.to_thread(self._write, batch)
+                except OSError as e:
+                    logger.warning(f"failed to write event journal: {e!r}")
+
+    def _read(self, after: int, before: Optional[int]) -> Iterator[Event]:
+        """逐行读取磁盘上 sn 在 (after, before) 之间的事件"""
+        segments = self._segments()
+        for index, (_, path) in enumerate(segments):
+            # 下一分段的起始 sn 不大于 after 时, 本分段不含需要补发的事件
+            if index + 1 < len(segments) and segments[index + 1][0] <= after + 1:
+                continue
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        raw = json.loads(line)
+                    except ValueError:
+                        continue
+                    sn = raw.get("sn", -1)
+                    if before is not None and sn >= before:
+                        return
+                    if sn > after:
+                        yield Event.parse(raw)
+
+    def _replay(self, after: int, tail: List[Event]) -> Iterator[Event]:
+        try:
+            yield from self._read(after, tail[0].sn if tail else None)
+        except OSError as e:
+            logger.warning(f"failed to read event journal: {e!r}")
+        yield from tail
+
+    def after(self, sn: int) -> Iterable[Event]:
+        """返回 sn 之后的事件
+
+        satori 在 identify 处理中同步调用并逐个发送, 磁盘上的事件以生成器按需逐行读取,
+        每次只在事件循环上做一次小的缓冲读, 不会一次性读入整个分段
+        """
+        tail = list(self._tail)
+        if tail and tail[0].sn <= sn + 1:
+            return [event for event in tail if event.sn > sn]
+        # 内存中的尾部不够时读取磁盘, 仅发生在消费端长时间断开后重连
+        return self._replay(sn, tail)
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
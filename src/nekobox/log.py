@@ -7,6 +7,10 @@ from types import TracebackType
 from loguru import logger
 from lagrange.utils.log import log
 
+LOG_FORMAT = (
+    "<g>{time:MM-DD HH:mm:ss}</g> | <lvl>{level: <8}</lvl> | <c><u>{name}</u></c> | <lvl>{message}</lvl>"
+)
+
 
 def loguru_exc_callback(cls: type[BaseException], val: BaseException, tb: Optional[TracebackType], *_, **__):
     """loguru 异常回调
@@ -62,7 +66,13 @@ def loguru_exc_callback_async(loop, context: dict):
     logger.opt(exception=exc_info).error("\n".join(log_lines))
 
 
-def patch_logging(level="INFO"):
+def patch_logging(level="INFO", diagnose=False):
+    """接管标准库日志, 并按 `level` 重新配置 loguru
+
+    移除已有的全部 sink (包括 loguru 默认的以及 lagrange `install_loguru` 添加的 0 级 sink),
+    以相同的等级重新添加控制台与文件 sink, 低于该等级的日志(及 `opt(lazy=True)` 的参数)不会被渲染;
+    文件 sink 经后台线程写入 (`enqueue=True`), `diagnose` 会在异常日志中输出变量值, 开销较大, 默认关闭
+    """
     for name in logging.root.manager.loggerDict:
         _logger = logging.getLogger(name)
         for handler in _logger.handlers:
@@ -71,15 +81,24 @@ def patch_logging(level="INFO"):
     sys.excepthook = loguru_exc_callback
     traceback.print_exception = loguru_exc_callback
     log.set_level(level)
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        format=LOG_FORMAT,
+        level=level.upper(),
+        backtrace=True,
+        diagnose=diagnose,
+        colorize=True,
+    )
     logger.add(
         "./logs/latest.log",
-        format="<g>{time:MM-DD HH:mm:ss}</g> | <lvl>{level: <8}</lvl> | <c><u>{name}</u></c> | <lvl>{message}</lvl>",
+        format=LOG_FORMAT,
         level=level.upper(),
-        enqueue=False,
+        enqueue=True,
         rotation="00:00",
         compression="zip",
         encoding="utf-8",
         backtrace=True,
-        diagnose=True,
+        diagnose=diagnose,
         colorize=False,
     )
@@ -1,16 +1,17 @@
 from __future__ import annotations
 
+import re
 import asyncio
 from io import BytesIO
 from pathlib import Path
-from contextlib import suppress
 from datetime import datetime, timedelta
-from typing import Set, List, Literal, Optional
+from typing import Set, List, Tuple, Literal, Optional
 
 from loguru import logger
 from lagrange import version
 from qrcode.main import QRCode
 from satori.model import Login
+from satori.server.utils import ctx
 from lagrange.info import InfoManager
 from starlette.responses import Response
 from lagrange.client.client import Client
@@ -20,21 +21,36 @@ from satori.server import Adapter, Request
 from lagrange.utils.sign import sign_provider
 from lagrange.info.app import AppInfo, app_list
 from lagrange.utils.audio.decoder import decode
-from graia.amnesia.builtins.memcache import MemcacheService
 
+from .rkey import rkeys
+from .uid import uid_index
+from .store import WarmStore
 from .log import patch_logging
+from .journal import EventJournal
 from .apis import apply_api_handlers
-from .events import apply_event_handler
 from .consts import PLATFORM, _set_server
-from .utils import HttpCatProxies, decode_audio, decode_audio_available
+from .repository import repo, member_lookup
+from .eventqueue import EventQueue, OverflowPolicy
+from .events import dispatcher, apply_event_handler
+from .msgstore import MessageStore, forwards, messages
+from .uid import DEFAULT_CAPACITY as DEFAULT_UID_CAPACITY
+from .mediacache import UploadCache, DiskMediaCache, uploads
+from .transformer import expand_forward, set_forward_options, set_media_concurrency
+from .utils import (
+    HttpCatProxies,
+    http_pool,
+    audio_pool,
+    decode_audio,
+    set_ffmpeg_limits,
+    set_download_max_size,
+    decode_audio_available,
+)
+
+RKEY_PATTERN = re.compile(r"[&?]rkey=[^&]*")
+PROXY_AVATAR_MAX_AGE = 86400
 
 
 class NekoBoxAdapter(Adapter):
-    def ensure_manager(self, manager: Launart):
-        super().ensure_manager(manager)
-        with suppress(ValueError):
-            manager.add_component(MemcacheService())
-
     def get_platform(self) -> str:
         return PLATFORM
 
@@ -51,48 +67,87 @@ class NekoBoxAdapter(Adapter):
 
     async def publisher(self):
         while True:
-            ev = await self.queue.get()
-            yield ev
+            # 短时间内的事件成批取出, 冗余的 login/reaction 事件合并后再推送
+            for ev in await self.queue.get_batch(self.event_batch_size, self.event_batch_window):
+                yield ev
 
     def ensure(self, platform: str, self_id: str) -> bool:
         # upload://{platform}/{self_id}/{path}...
         return platform == PLATFORM and self_id == str(self.uin)
 
+    async def _load_audio(self, src_typ: str, src: str, key: str) -> Tuple[bytes, str]:
+        if src_typ == "gid":
+            link = await self.client.fetch_audio_url(key, gid=int(src))
+        elif src_typ == "uid":
+            link = await self.client.fetch_audio_url(key, uid=src)
+        else:
+            raise ValueError(f"Unknown source type: {src_typ}")
+        raw = await HttpCatProxies.request(
+            "GET",
+            link.replace("https", "http"),  # multimedia server certificate check failure
+            conn_timeout=15,
+        )
+        if raw.code != 200:
+            raise ConnectionError(raw.code, raw.text())
+        data = raw.decompressed_body
+        typ = decode(BytesIO(data))
+        if decode_audio_available(typ.type):
+            return await decode_audio(typ.type, data), "audio/x-wav"
+        else:
+            return data, "application/octet-stream"
+
     async def handle_internal(self, request: Request, path: str) -> Response:
         if not path.startswith("_raw"):
             res_typ, src_typ, src, key = path.split("/", 3)
             if res_typ == "audio":
-                if src_typ == "gid":
-                    link = await self.client.fetch_audio_url(key, gid=int(src))
-                elif src_typ == "uid":
-                    link = await self.client.fetch_audio_url(key, uid=src)
-                else:
-                    raise ValueError(f"Unknown source type: {src_typ}")
-                raw = await HttpCatProxies.request(
-                    "GET",
-                    link.replace("https", "http"),  # multimedia server certificate check failure
-                    conn_timeout=15,
-                )
-                if raw.code != 200:
-                    raise ConnectionError(raw.code, raw.text())
-                data = raw.decompressed_body
-                typ = decode(BytesIO(data))
-                if decode_audio_available(typ.type):
-                    return Response(await decode_audio(typ.type, data))
-                else:
+                if not self.audio_cache.enabled:
+                    data, _ = await self._load_audio(src_typ, src, key)
                     return Response(data)
+                # file_key 对应的语音内容不变, 解码结果可直接复用
+                return await self.audio_cache.serve(key, lambda: self._load_audio(src_typ, src, key))
+            if res_typ == "forward":
+                # lazy 模式或超出展开限制的合并转发占位, key 为 resid
+                forward = await expand_forward(
+                    self.client,
+                    self.client.uin,
+                    key,
+                    gid=int(src) if src_typ == "gid" else None,
+                    uid=src if src_typ == "uid" else None,
+                )
+                return Response(str(forward), media_type="text/xml")
         raise NotImplementedError(path)
 
-    async def handle_proxied(self, prefix: str, url: str) -> Optional[Response]:
-        url = url.replace("&amp;", "&")
+    async def _with_rkey(self, prefix: str, url: str) -> str:
         if prefix == "https://multimedia.nt.qq.com.cn/":
-            _, rkey = await self.client.get_rkey()
+            _, rkey = await rkeys.get(self.client)
             url = f"{url}{rkey}"
         elif prefix == "https://gchat.qpic.cn":
             if url.startswith("https://gchat.qpic.cn/download"):
-                _, rkey = await self.client.get_rkey()
+                _, rkey = await rkeys.get(self.client)
                 url = f"{url}{rkey}"
-        return await super().handle_proxied(prefix, url)
+        return url
+
+    async def _fetch_proxied(self, prefix: str, url: str, retry=True) -> Tuple[bytes, str]:
+        target = await self._with_rkey(prefix, url)
+        async with self.server.session.get(target, ssl=ctx) as resp:
+            if resp.status == 200:
+                return await resp.read(), resp.content_type
+            if retry and target != url and resp.status in (400, 403):
+                # rkey 可能已提前失效, 强制刷新后重试一次
+                rkeys.invalidate(self.client)
+            else:
+                raise ConnectionError(resp.status, await resp.text())
+        return await self._fetch_proxied(prefix, url, retry=False)
+
+    async def handle_proxied(self, prefix: str, url: str) -> Optional[Response]:
+        url = url.replace("&amp;", "&")
+        if not self.proxy_cache.enabled:
+            return await super().handle_proxied(prefix, await self._with_rkey(prefix, url))
+        # 头像会更新, 需要定期失效; 图片内容不变, 只按 LRU 淘汰
+        max_age = PROXY_AVATAR_MAX_AGE if "qlogo.cn" in prefix else None
+        return await self.proxy_cache.serve(
+            RKEY_PATTERN.sub("", url), lambda: self._fetch_proxied(prefix, url), max_age
+        )
 
     def _get_login(self):
         return Login(
@@ -129,6 +184,36 @@ class NekoBoxAdapter(Adapter):
         protocol: Literal["linux", "macos", "windows", "remote"] = "linux",
         log_level: str = "INFO",
         use_png: bool = False,
+        uid_cache_size: int = DEFAULT_UID_CAPACITY,
+        message_cache_size: int = 50_000,
+        message_cache_bytes: int = 32 * 1024 * 1024,
+        message_overflow: bool = False,
+        media_concurrency: int = 4,
+        upload_cache_size: int = 4096,
+        download_max_size: int = 64 * 1024 * 1024,
+        http_pool_size: int = 8,
+        http_idle_timeout: float = 30.0,
+        media_cache_size: int = 256 * 1024 * 1024,
+        audio_cache_size: int = 64 * 1024 * 1024,
+        ffmpeg_concurrency: int = 2,
+        ffmpeg_timeout: float = 30.0,
+        audio_workers: int = 2,
+        audio_queue_size: int = 32,
+        event_concurrency: int = 16,
+        event_queue_size: int = 10_000,
+        event_queue_policy: OverflowPolicy = "block",
+        event_backlog_size: int = 10_000,
+        event_batch_size: int = 64,
+        event_batch_window: float = 0.01,
+        member_batch_window: float = 0.005,
+        member_roster_threshold: int = 8,
+        forward_mode: Literal["eager", "lazy"] = "eager",
+        forward_max_depth: int = 3,
+        forward_max_nodes: int = 200,
+        forward_cache_size: int = 20_000,
+        event_journal: bool = False,
+        event_journal_retention: timedelta = timedelta(days=1),
+        log_diagnose: bool = False,
         _patch_logging: bool = False,
     ):
         self.log_level = log_level.upper()
@@ -137,17 +222,45 @@ class NekoBoxAdapter(Adapter):
         scope.mkdir(exist_ok=True, parents=True)
 
         self.im = InfoManager(uin, scope / "device.json", scope / "sig.bin")
+        self.store = WarmStore(scope / "cache.db")
+        self.journal = (
+            EventJournal(scope / "events", retention=event_journal_retention) if event_journal else None
+        )
         self.uin = uin
         self.name = ""
         self.sign = None
-        self.queue = asyncio.Queue()
+        self.queue = EventQueue(event_queue_size, event_queue_policy)
+        self.event_batch_size = event_batch_size
+        self.event_batch_window = event_batch_window
         self.use_png = use_png
+        uid_index.resize(uid_cache_size)
+        # 消息与缓存按 bot 区分, 事件与 API 处理中通过 client.uin 取得
+        self.messages = messages.bind(
+            uin, MessageStore(max_messages=message_cache_size, max_bytes=message_cache_bytes)
+        )
+        if message_overflow:
+            self.messages.configure(overflow=scope / "messages.db")
+        self.uploads = uploads.bind(uin, UploadCache(upload_cache_size))
+        self.proxy_cache = DiskMediaCache(media_cache_size)
+        self.proxy_cache.configure(scope / "media")
+        # internal 语音接口解码后的 wav
+        self.audio_cache = DiskMediaCache(audio_cache_size)
+        self.audio_cache.configure(scope / "audio")
+        set_media_concurrency(media_concurrency)
+        set_download_max_size(download_max_size)
+        http_pool.configure(max_per_host=http_pool_size, idle_timeout=http_idle_timeout)
+        set_ffmpeg_limits(ffmpeg_concurrency, ffmpeg_timeout)
+        audio_pool.configure(workers=audio_workers, max_queue=audio_queue_size)
+        dispatcher.configure(event_concurrency, event_backlog_size, event_queue_policy)
+        member_lookup.configure(member_batch_window, member_roster_threshold)
+        set_forward_options(forward_mode, forward_max_depth, forward_max_nodes)
+        forwards.configure(forward_cache_size)
 
         self._protocol = protocol
         self._sign_url = sign_url
 
         if _patch_logging:
-            patch_logging(self.log_level)
+            patch_logging(self.log_level, log_diagnose)
 
         super().__init__()
 
@@ -183,6 +296,9 @@ class NekoBoxAdapter(Adapter):
 
         logger.info(f"Running on '{version.__version__}' for {self.uin}")
         _set_server(self.server)
+        if self.journal:
+            await self.journal.open()
+            self.journal.attach(self.server)
 
         with self.im as im:
             if (
@@ -229,6 +345,8 @@ class NekoBoxAdapter(Adapter):
                 logins = await self.get_logins()
                 return logins[0]
 
+            restore_task = asyncio.create_task(self.store.restore(repo))
+
             async with self.stage("preparing"):
                 client.connect()
                 success = True
@@ -256,11 +374,22 @@ class NekoBoxAdapter(Adapter):
             async with self.stage("blocking"):
                 if success:
                     im.save_all()
+                    rkeys.prefetch(client)
                     self.name = (await client.get_user_info(client.uin)).name
+                    flush_task = asyncio.create_task(self.store.run(repo))
                     await any_completed(manager.status.wait_for_sigexit(), client._network.wait_closed())
+                    flush_task.cancel()
 
             async with self.stage("cleanup"):
                 logger.debug("stopping client...")
                 await client.stop()
+                await restore_task
+                await self.store.flush(repo)
+                await self.messages.close()
+                if self.journal:
+                    await self.journal.close()
+                await http_pool.close()
+                audio_pool.shutdown()
+                await logger.complete()
 
             logger.success("Client stopped")
@@ -0,0 +1,276 @@
+import os
+import time
+import asyncio
+import hashlib
+import mimetypes
+from copy import copy
+from pathlib import Path
+from datetime import timedelta
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Set, Dict, Tuple, Union, Generic, TypeVar, BinaryIO, Callable, Optional, Awaitable
+
+from starlette.responses import FileResponse
+from starlette.types import Send, Scope, Receive
+
+from .cache import PerBot, SingleFlight
+
+T = TypeVar("T")
+
+# (媒体类型, grp_id, uid, 内容哈希), 群与私聊的上传结果不能互用
+UploadKey = Tuple[str, int, str, str]
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class UploadCache(Generic[T]):
+    """按内容哈希缓存已上传的 Image/Audio 元素, 相同内容发送到同一目标时跳过上传"""
+
+    def __init__(self, capacity: int = 4096, ttl: timedelta = timedelta(days=1)):
+        self.capacity = capacity
+        self.ttl = ttl.total_seconds()
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[UploadKey, Tuple[float, T]]" = OrderedDict()
+        self._flight: SingleFlight[UploadKey, T] = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def digest(data: Union[bytes, BinaryIO]) -> str:
+        if isinstance(data, bytes):
+            return hashlib.sha256(data).hexdigest()
+        h = hashlib.sha256()
+        data.seek(0)
+        while chunk := data.read(64 * 1024):
+            h.update(chunk)
+        data.seek(0)
+        return h.hexdigest()
+
+    def configure(self, capacity: Optional[int] = None, ttl: Optional[timedelta] = None) -> None:
+        if capacity is not None:
+            self.capacity = capacity
+        if ttl is not None:
+            self.ttl = ttl.total_seconds()
+        self._evict()
+
+    def get(self, key: UploadKey) -> Optional[T]:
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] >= self.ttl:
+            if entry is not None:
+                del self._entries[key]
+                self.stats.evictions += 1
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        # 发送时元素可能被修改, 返回副本
+        return copy(entry[1])
+
+    def put(self, key: UploadKey, elem: T) -> None:
+        if self.capacity <= 0:
+            return
+        self._entries[key] = (time.time(), elem)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _evict(self) -> None:
+        while len(self._entries) > max(self.capacity, 0):
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def _upload(
+        self, key: UploadKey, func: Callable[[], Awaitable[T]], source: Optional[BinaryIO]
+    ) -> T:
+        try:
+            elem = await func()
+        finally:
+            if source is not None:
+                source.close()
+        self.put(key, elem)
+        return elem
+
+    async def upload(
+        self, key: UploadKey, func: Callable[[], Awaitable[T]], source: Optional[BinaryIO] = None
+    ) -> T:
+        """上传并缓存结果, 同一内容的并发上传只执行一次
+
+        `source` 为 `func` 读取的文件对象, 由本方法负责关闭: 实际执行上传时在上传任务结束后关闭,
+        命中缓存或已有相同上传在进行时立即关闭. 发起者被取消时上传任务仍持有它, 不影响其他等待者
+        """
+        elem = self.get(key)
+        if source is not None and (elem is not None or key in self._flight):
+            source.close()
+        if elem is not None:
+            return elem
+        return copy(await self._flight.do(key, lambda: self._upload(key, func, source)))
+
+
+uploads: PerBot[UploadCache] = PerBot(UploadCache)
+
+
+class DiskMediaCache:
+    """代理媒体(头像, 群图片等)的磁盘缓存, 按总大小做 LRU 淘汰
+
+    文件名为 key 的哈希加上由 content-type 推断的扩展名, 以便 FileResponse 推断 media type
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.root: Optional[Path] = None
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        # digest -> (path, size, stored_at)
+        self._entries: "OrderedDict[str, Tuple[Path, int, float]]" = OrderedDict()
+        self._size = 0
+        self._flight: SingleFlight[str, Path] = SingleFlight()
+        # 正在发送的文件及引用数; 其中已被淘汰的文件在释放后再删除
+        self._pins: Dict[Path, int] = {}
+        self._doomed: Set[Path] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None and self.max_bytes > 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def configure(self, root: Optional[Path], max_bytes: Optional[int] = None) -> None:
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self.root = root
+        self._entries.clear()
+        self._size = 0
+        if not self.enabled:
+            return
+        root.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in root.iterdir():
+            if path.is_file() and not path.name.endswith(".tmp"):
+                stat = path.stat()
+                files.append((stat.st_mtime, path, stat.st_size))
+        for mtime, path, size in sorted(files):
+            self._entries[path.name.split(".", 1)[0]] = (path, size, mtime)
+            self._size += size
+        self._evict()
+
+    @staticmethod
+    def digest(key: str) -> str:
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Optional[Path]:
+        digest = self.digest(key)
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        path, size, stored_at = entry
+        if (max_age is not None and time.time() - stored_at >= max_age) or not path.exists():
+            self._remove(digest)
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.stats.hits += 1
+        return path
+
+    async def fetch(
+        self, key: str, loader: Callable[[], Awaitable[Tuple[bytes, str]]], max_age: Optional[float] = None
+    ) -> Path:
+        """命中时返回缓存文件, 否则调用 `loader` 获取 (内容, content-type) 并写入磁盘, 并发请求合并为一次"""
+        if path := self.get(key, max_age):
+            return path
+        digest = self.digest(key)
+        return await self._flight.do(digest, lambda: self._fetch(digest, loader))
+
+    async def serve(
+        self, key: str, loader: Callable[[], Awaitable[Tuple[bytes, str]]], max_age: Optional[float] = None
+    ) -> "CachedFileResponse":
+        """与 `fetch` 相同, 但返回的响应在发送完成前固定文件, 期间不会被淘汰删除"""
+        while True:
+            path = await self.fetch(key, loader, max_age)
+            # 等待合并的请求期间, 文件可能已被其他写入淘汰
+            if path.exists():
+                return CachedFileResponse(self, path)
+
+    def acquire(self, path: Path) -> None:
+        self._pins[path] = self._pins.get(path, 0) + 1
+
+    def release(self, path: Path) -> None:
+        count = self._pins.pop(path) - 1
+        if count:
+            self._pins[path] = count
+        elif path in self._doomed:
+            self._doomed.discard(path)
+            path.unlink(missing_ok=True)
+
+    async def _fetch(self, digest: str, loader: Callable[[], Awaitable[Tuple[bytes, str]]]) -> Path:
+        assert self.root
+        data, content_type = await loader()
+        ext = mimetypes.guess_extension(content_type.split(";", 1)[0].strip()) if content_type else None
+        path = self.root / f"{digest}{ext or ''}"
+        await asyncio.to_thread(self._write, path, data)
+        # 刚写入的文件不能再删除
+        self._doomed.discard(path)
+        if (old := self._entries.pop(digest, None)) is not None:
+            self._size -= old[1]
+            if old[0] != path:
+                self._unlink(old[0])
+        self._entries[digest] = (path, len(data), time.time())
+        self._size += len(data)
+        self._evict()
+        return path
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _remove(self, digest: str) -> None:
+        path, size, _ = self._entries.pop(digest)
+        self._size -= size
+        self._unlink(path)
+
+    def _unlink(self, path: Path) -> None:
+        if path in self._pins:
+            self._doomed.add(path)
+        else:
+            path.unlink(missing_ok=True)
+
+    def _evict(self) -> None:
+        # 至少保留最新写入的一项, 其文件可能正要被返回
+        while len(self._entries) > 1 and self._size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats.evictions += 1
+
+
+class CachedFileResponse(FileResponse):
+    """发送 `DiskMediaCache` 中的文件, 发送结束(或调用 `release`)前文件不会被淘汰删除"""
+
+    def __init__(self, cache: DiskMediaCache, path: Path, **kwargs):
+        super().__init__(path, **kwargs)
+        self._cache = cache
+        self._pinned: Optional[Path] = path
+        cache.acquire(path)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+    def release(self) -> None:
+        if self._pinned is not None:
+            self._cache.release(self._pinned)
+            self._pinned = None
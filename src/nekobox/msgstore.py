@@ -0,0 +1,252 @@
+import time
+import asyncio
+import sqlite3
+from pathlib import Path
+from collections import OrderedDict
+from dataclasses import astuple, dataclass
+from typing import TYPE_CHECKING, Set, List, Tuple, Optional
+
+from loguru import logger
+
+from .cache import PerBot, SingleFlight
+
+if TYPE_CHECKING:
+    from lagrange.client.client import Client
+    from lagrange.client.message.elems import MulitMsg
+
+# (msg type, grp_id or friend uin), msg type 同 msgid
+ChannelKey = Tuple[int, int]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS message (
+    typ INTEGER NOT NULL,
+    peer INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    uin INTEGER NOT NULL,
+    uid TEXT NOT NULL,
+    nickname TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    content TEXT NOT NULL,
+    peer_name TEXT NOT NULL,
+    PRIMARY KEY (typ, peer, seq)
+);
+"""
+
+
+@dataclass
+class StoredMessage:
+    typ: int
+    peer: int
+    seq: int
+    uin: int
+    uid: str
+    nickname: str
+    time: int
+    text: str  # 纯文本摘要, 用于构造引用
+    content: str  # satori 消息内容
+    peer_name: str = ""
+
+
+class MessageStore:
+    """按频道保存最近的消息, 超出内存上限 (条数或 `max_bytes`) 的消息可选地溢出到磁盘"""
+
+    def __init__(
+        self,
+        per_channel: int = 500,
+        max_messages: int = 50_000,
+        max_bytes: int = 32 * 1024 * 1024,
+        flush_size: int = 256,
+    ):
+        self.per_channel = per_channel
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.flush_size = flush_size
+        self.overflow: Optional[Path] = None
+        self.retention = 7 * 86400
+        self._channels: "OrderedDict[ChannelKey, OrderedDict[int, StoredMessage]]" = OrderedDict()
+        self._total = 0
+        self._bytes = 0
+        self._pending: List[StoredMessage] = []
+        self._writing: List[StoredMessage] = []
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return self._total
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    @staticmethod
+    def _weigh(msg: StoredMessage) -> int:
+        # 按字符数近似, 只用于内存预算
+        return len(msg.text) + len(msg.content) + len(msg.nickname) + len(msg.peer_name)
+
+    def configure(
+        self,
+        per_channel: Optional[int] = None,
+        max_messages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        overflow: Optional[Path] = None,
+    ) -> None:
+        if per_channel is not None:
+            self.per_channel = per_channel
+        if max_messages is not None:
+            self.max_messages = max_messages
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self.overflow = overflow
+        if overflow:
+            conn = sqlite3.connect(overflow)
+            try:
+                conn.executescript(_SCHEMA)
+            finally:
+                conn.close()
+
+    def add(self, msg: StoredMessage) -> None:
+        key = (msg.typ, msg.peer)
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = self._channels[key] = OrderedDict()
+        else:
+            self._channels.move_to_end(key)
+        if (old := channel.get(msg.seq)) is not None:
+            self._bytes -= self._weigh(old)
+        else:
+            self._total += 1
+        channel[msg.seq] = msg
+        self._bytes += self._weigh(msg)
+        while len(channel) > self.per_channel:
+            self._evict(channel.popitem(last=False)[1])
+        while self._channels and (self._total > self.max_messages or self._bytes > self.max_bytes):
+            oldest_key, oldest = next(iter(self._channels.items()))
+            self._evict(oldest.popitem(last=False)[1])
+            if not oldest:
+                del self._channels[oldest_key]
+
+    def _evict(self, msg: StoredMessage) -> None:
+        self._total -= 1
+        self._bytes -= self._weigh(msg)
+        if self.overflow:
+            self._pending.append(msg)
+            if len(self._pending) >= self.flush_size:
+                task = asyncio.create_task(self.flush())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def get(self, typ: int, peer: int, seq: int) -> Optional[StoredMessage]:
+        if (channel := self._channels.get((typ, peer))) and (msg := channel.get(seq)):
+            return msg
+        if not self.overflow:
+            return None
+        for msg in (*self._pending, *self._writing):
+            if msg.typ == typ and msg.peer == peer and msg.seq == seq:
+                return msg
+        try:
+            row = await asyncio.to_thread(self._read, self.overflow, typ, peer, seq)
+        except sqlite3.Error as e:
+            logger.warning(f"failed to read message overflow: {e!r}")
+            return None
+        return StoredMessage(*row) if row else None
+
+    @staticmethod
+    def _read(path: Path, typ: int, peer: int, seq: int):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute(
+                "SELECT * FROM message WHERE typ = ? AND peer = ? AND seq = ?", (typ, peer, seq)
+            ).fetchone()
+        finally:
+            conn.close()
+
+    def _write(self, path: Path, batch: List[StoredMessage]) -> None:
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO message VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [astuple(msg) for msg in batch],
+                )
+                conn.execute("DELETE FROM message WHERE time < ?", (int(time.time()) - self.retention,))
+        finally:
+            conn.close()
+
+    async def flush(self) -> None:
+        if not (self.overflow and self._pending):
+            return
+        async with self._lock:
+            batch, self._pending = self._pending, []
+            self._writing = batch
+            try:
+                await asyncio.to_thread(self._write, self.overflow, batch)
+            except sqlite3.Error as e:
+                logger.warning(f"failed to write message overflow: {e!r}")
+            finally:
+                self._writing = []
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+
+messages: PerBot[MessageStore] = PerBot(MessageStore)
+
+
+class ForwardCache:
+    """按 resid 缓存已拉取的合并转发, 以节点与元素总数作为容量预算, 按 LRU 淘汰"""
+
+    def __init__(self, max_weight: int = 20_000):
+        self.max_weight = max_weight
+        self._entries: "OrderedDict[Tuple[str, bool], Tuple[MulitMsg, int]]" = OrderedDict()
+        self._weight = 0
+        self._flight: SingleFlight[Tuple[str, bool], "MulitMsg"] = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _weigh(forward: "MulitMsg") -> int:
+        return sum(1 + len(node.content) for node in forward.messages) or 1
+
+    def configure(self, max_weight: int) -> None:
+        self.max_weight = max_weight
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._entries and self._weight > self.max_weight:
+            _, (_, weight) = self._entries.popitem(last=False)
+            self._weight -= weight
+
+    def get(self, resid: str, is_group: bool) -> Optional["MulitMsg"]:
+        if entry := self._entries.get((resid, is_group)):
+            self._entries.move_to_end((resid, is_group))
+            return entry[0]
+        return None
+
+    def put(self, resid: str, is_group: bool, forward: "MulitMsg") -> None:
+        key = (resid, is_group)
+        if old := self._entries.pop(key, None):
+            self._weight -= old[1]
+        weight = self._weigh(forward)
+        # 单个超出预算的转发不缓存, 否则会把其余条目全部挤出
+        if weight > self.max_weight:
+            return
+        self._entries[key] = (forward, weight)
+        self._weight += weight
+        self._evict()
+
+    async def _fetch(self, client: "Client", resid: str, is_group: bool) -> "MulitMsg":
+        forward = await client.get_forward_msg(resid, is_group=is_group)
+        self.put(resid, is_group, forward)
+        return forward
+
+    async def fetch(self, client: "Client", resid: str, is_group: bool) -> "MulitMsg":
+        if forward := self.get(resid, is_group):
+            return forward
+        return await self._flight.do((resid, is_group), lambda: self._fetch(client, resid, is_group))
+
+
+forwards = ForwardCache()
@@ -0,0 +1,271 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Set, Dict, List, Tuple, Callable, Optional, Awaitable
+
+from loguru import logger
+from satori import User, Guild, Member, Channel, ChannelType
+from lagrange.pb.service.group import FetchGrpRspBody, GetGrpMemberInfoRspBody
+
+from .uid import save_uid
+from .cache import SWRCache
+from .msgid import encode_msgid
+
+if TYPE_CHECKING:
+    from lagrange.client.client import Client
+
+
+def make_guild(grp_id: int, name: Optional[str] = None) -> Guild:
+    return Guild(str(grp_id), name or str(grp_id), f"https://p.qlogo.cn/gh/{grp_id}/{grp_id}/640")
+
+
+def make_channel(grp_id: int, name: Optional[str] = None) -> Channel:
+    return Channel(encode_msgid(1, grp_id), ChannelType.TEXT, name or str(grp_id))
+
+
+def make_member(body: GetGrpMemberInfoRspBody) -> Member:
+    return Member(
+        user=User(
+            id=str(body.account.uin),
+            name=body.nickname,
+            avatar=f"http://thirdqq.qlogo.cn/headimg_dl?dst_uin={body.account.uin}&spec=640",
+        ),
+        nick=body.name.string if body.name else body.nickname,
+        avatar=f"http://thirdqq.qlogo.cn/headimg_dl?dst_uin={body.account.uin}&spec=640",
+        joined_at=datetime.fromtimestamp(body.joined_time),
+    )
+
+
+class EntityRepository:
+    """guild/channel/user/member/入群申请 的类型化缓存
+
+    所有实体只保存一份, 列表接口(guild-list, friend-list) 只记录 id 并从对应的表中取值
+    """
+
+    def __init__(
+        self,
+        ttl: timedelta = timedelta(minutes=5),
+        max_stale: timedelta = timedelta(hours=1),
+        join_request_ttl: timedelta = timedelta(minutes=30),
+        roster_ttl: timedelta = timedelta(minutes=30),
+        roster_max_stale: timedelta = timedelta(hours=6),
+    ):
+        self.guilds: SWRCache[int, Guild] = SWRCache(ttl, max_stale)
+        self.channels: SWRCache[int, Channel] = SWRCache(ttl, max_stale)
+        self.users: SWRCache[int, User] = SWRCache(ttl, max_stale)
+        self.members: SWRCache[Tuple[int, int], Member] = SWRCache(ttl, max_stale)
+        self.join_requests: SWRCache[int, FetchGrpRspBody] = SWRCache(join_request_ttl)
+        # grp_id -> {uin: Member}, 由 join/quit 事件增量维护
+        self.rosters: SWRCache[int, Dict[int, Member]] = SWRCache(roster_ttl, roster_max_stale)
+        # guild-list/friend-list 的 id 列表, 与实体一同持久化到 warm store
+        self.listings: SWRCache[Tuple[str, int], List[int]] = SWRCache(ttl, max_stale)
+
+    def tables(self) -> Dict[str, SWRCache]:
+        return {
+            "guild": self.guilds,
+            "channel": self.channels,
+            "user": self.users,
+            "member": self.members,
+        }
+
+    def purge(self) -> int:
+        return sum(
+            table.purge()
+            for table in (*self.tables().values(), self.join_requests, self.rosters, self.listings)
+        )
+
+    def put_guild(self, guild: Guild, channel: Optional[Channel] = None) -> None:
+        grp_id = int(guild.id)
+        self.guilds.put(grp_id, guild)
+        self.channels.put(grp_id, channel or make_channel(grp_id, guild.name))
+
+    async def _load_guilds(self, client: "Client") -> List[int]:
+        grp_list = (await client.get_grp_list()).grp_list
+        self.guilds.put_many((g.grp_id, make_guild(g.grp_id, g.info.grp_name)) for g in grp_list)
+        self.channels.put_many((g.grp_id, make_channel(g.grp_id, g.info.grp_name)) for g in grp_list)
+        return [g.grp_id for g in grp_list]
+
+    async def _load_friends(self, client: "Client") -> List[int]:
+        friends = await client.get_friend_list()
+        for frd in friends:
+            if frd.uid:
+                save_uid(frd.uin, frd.uid)
+        self.users.put_many(
+            (
+                frd.uin,
+                User(
+                    str(frd.uin),
+                    frd.nickname,
+                    frd.remark,
+                    avatar=f"https://q1.qlogo.cn/g?b=qq&nk={frd.uin}&s=640",
+                ),
+            )
+            for frd in friends
+        )
+        return [frd.uin for frd in friends]
+
+    async def list_guilds(self, client: "Client", force=False) -> List[Guild]:
+        ids = await self.listings.get(("guild", client.uin), lambda: self._load_guilds(client), force)
+        return list(self.guilds.get_many(ids, allow_stale=True).values())
+
+    async def list_friends(self, client: "Client", force=False) -> List[User]:
+        ids = await self.listings.get(("friend", client.uin), lambda: self._load_friends(client), force)
+        return list(self.users.get_many(ids, allow_stale=True).values())
+
+    def _revalidate_guilds(self, client: "Client") -> None:
+        self.listings.revalidate(("guild", client.uin), lambda: self._load_guilds(client))
+
+    async def _ensure_guild(self, client: "Client", grp_id: int) -> None:
+        await self.list_guilds(client)
+        if self.guilds.peek(grp_id) is None:
+            # 可能是新加入的群, 在后台刷新群列表
+            self._revalidate_guilds(client)
+
+    async def get_guild(self, client: "Client", grp_id: int) -> Guild:
+        if guild := self.guilds.get_fresh(grp_id):
+            return guild
+        # 过期但仍可用的值(如从 warm store 恢复的)直接返回, 在后台刷新群列表
+        if guild := self.guilds.peek(grp_id):
+            self._revalidate_guilds(client)
+            return guild
+        await self._ensure_guild(client, grp_id)
+        return self.guilds.peek(grp_id) or make_guild(grp_id)
+
+    async def get_channel(self, client: "Client", grp_id: int) -> Channel:
+        if channel := self.channels.get_fresh(grp_id):
+            return channel
+        if channel := self.channels.peek(grp_id):
+            self._revalidate_guilds(client)
+            return channel
+        await self._ensure_guild(client, grp_id)
+        return self.channels.peek(grp_id) or make_channel(grp_id)
+
+    async def get_friend(self, client: "Client", uin: int) -> Optional[User]:
+        if user := self.users.get_fresh(uin):
+            return user
+        if user := self.users.peek(uin):
+            self.listings.revalidate(("friend", client.uin), lambda: self._load_friends(client))
+            return user
+        await self.list_friends(client)
+        return self.users.peek(uin)
+
+    async def _load_roster(self, client: "Client", grp_id: int) -> Dict[int, Member]:
+        roster: Dict[int, Member] = {}
+        next_key = None
+        while True:
+            rsp = await client.get_grp_members(grp_id, next_key=next_key)
+            for body in rsp.body:
+                if body.account.uin is None:
+                    continue
+                save_uid(body.account.uin, body.account.uid)
+                roster[body.account.uin] = make_member(body)
+            if not rsp.next_key:
+                break
+            next_key = rsp.next_key.decode()
+        self.members.put_many(((grp_id, uin), member) for uin, member in roster.items())
+        return roster
+
+    async def get_roster(self, client: "Client", grp_id: int, force=False) -> Dict[int, Member]:
+        return await self.rosters.get(grp_id, lambda: self._load_roster(client, grp_id), force)
+
+    def roster_add(self, grp_id: int, uin: int, member: Member) -> None:
+        if (roster := self.rosters.peek(grp_id)) is not None:
+            roster[uin] = member
+
+    def roster_remove(self, grp_id: int, uin: int) -> None:
+        self.members.invalidate((grp_id, uin))
+        if (roster := self.rosters.peek(grp_id)) is not None:
+            roster.pop(uin, None)
+
+    async def get_member(self, grp_id: int, uin: int, loader: Callable[[], Awaitable[Member]]) -> Member:
+        if self.members.get_fresh((grp_id, uin)) is None:
+            roster = self.rosters.peek(grp_id)
+            if roster and uin in roster:
+                return roster[uin]
+        return await self.members.get((grp_id, uin), loader)
+
+
+repo = EntityRepository()
+
+
+class MemberLookup:
+    """合并短时间内同一群的成员信息查询
+
+    在 `window` 秒内到达的查询按群收集, 同一 uid 只请求一次; 数量达到 `roster_threshold` 时
+    改为分页拉取成员列表, 翻页次数不超过剩余未命中的数量, 仍未找到的再逐个查询
+    """
+
+    def __init__(self, window: float = 0.005, roster_threshold: int = 8):
+        self.window = window
+        self.roster_threshold = roster_threshold
+        self._pending: Dict[int, Dict[str, asyncio.Future]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def configure(self, window: Optional[float] = None, roster_threshold: Optional[int] = None) -> None:
+        if window is not None:
+            self.window = window
+        if roster_threshold is not None:
+            self.roster_threshold = roster_threshold
+
+    async def get(self, client: "Client", grp_id: int, uid: str) -> GetGrpMemberInfoRspBody:
+        batch = self._pending.get(grp_id)
+        if batch is None:
+            batch = self._pending[grp_id] = {}
+            task = asyncio.create_task(self._flush(client, grp_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if (fut := batch.get(uid)) is None:
+            fut = batch[uid] = asyncio.get_running_loop().create_future()
+        # 结果由同批的所有调用方共享, 单个调用方被取消时不影响其他调用方
+        return await asyncio.shield(fut)
+
+    async def _flush(self, client: "Client", grp_id: int) -> None:
+        await asyncio.sleep(self.window)
+        batch = self._pending.pop(grp_id)
+        try:
+            if len(batch) >= self.roster_threshold:
+                await self._fetch_roster(client, grp_id, batch)
+            await asyncio.gather(
+                *(self._fetch_one(client, grp_id, uid, fut) for uid, fut in batch.items() if not fut.done())
+            )
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+
+    @staticmethod
+    async def _fetch_one(client: "Client", grp_id: int, uid: str, fut: asyncio.Future) -> None:
+        try:
+            rsp = await client.get_grp_member_info(grp_id, uid)
+            if not rsp.body:
+                raise ValueError(f"member {uid} not found in group {grp_id}")
+            fut.set_result(rsp.body[0])
+        except Exception as e:
+            fut.set_exception(e)
+
+    @staticmethod
+    async def _fetch_roster(client: "Client", grp_id: int, batch: Dict[str, asyncio.Future]) -> None:
+        remaining = len(batch)
+        next_key = None
+        pages = 0
+        while remaining and pages < remaining:
+            try:
+                rsp = await client.get_grp_members(grp_id, next_key=next_key)
+            except Exception as e:
+                logger.warning(f"failed to fetch member list of group {grp_id}: {e!r}")
+                return
+            pages += 1
+            for body in rsp.body:
+                if body.account.uin is not None:
+                    save_uid(body.account.uin, body.account.uid)
+                if (fut := batch.get(body.account.uid)) and not fut.done():
+                    fut.set_result(body)
+                    remaining -= 1
+            if not rsp.next_key:
+                break
+            next_key = rsp.next_key.decode()
+        logger.trace(
+            f"member lookup of group {grp_id}: {len(batch) - remaining}/{len(batch)} in {pages} page(s)"
+        )
+
+
+member_lookup = MemberLookup()
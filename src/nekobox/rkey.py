@@ -0,0 +1,50 @@
+from datetime import timedelta
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Tuple
+
+from .cache import SWRCache
+
+if TYPE_CHECKING:
+    from lagrange.client.client import Client
+
+
+@dataclass
+class RkeyStats:
+    refreshes: int = 0
+    failures: int = 0
+    stale_uses: int = 0
+
+
+class RkeyManager:
+    """缓存 `get_rkey` 的结果 (private, group)
+
+    超过 `lifetime - refresh_ahead` 后继续返回当前 rkey 并在后台刷新, 并发调用共享同一次刷新
+    """
+
+    def __init__(
+        self, lifetime: timedelta = timedelta(hours=1), refresh_ahead: timedelta = timedelta(minutes=10)
+    ):
+        self.stats = RkeyStats()
+        self._cache: SWRCache[int, Tuple[str, str]] = SWRCache(lifetime - refresh_ahead, lifetime)
+
+    async def _load(self, client: "Client") -> Tuple[str, str]:
+        self.stats.refreshes += 1
+        try:
+            return await client.get_rkey()
+        except Exception:
+            self.stats.failures += 1
+            raise
+
+    async def get(self, client: "Client") -> Tuple[str, str]:
+        if self._cache.get_fresh(client.uin) is None and self._cache.peek(client.uin) is not None:
+            self.stats.stale_uses += 1
+        return await self._cache.get(client.uin, lambda: self._load(client))
+
+    def prefetch(self, client: "Client") -> None:
+        self._cache.revalidate(client.uin, lambda: self._load(client))
+
+    def invalidate(self, client: "Client") -> None:
+        self._cache.invalidate(client.uin)
+
+
+rkeys = RkeyManager()
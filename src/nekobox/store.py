@@ -0,0 +1,147 @@
+import json
+import time
+import asyncio
+import sqlite3
+from pathlib import Path
+from datetime import timedelta
+from typing import Any, Dict, List, Tuple, Callable, Optional
+
+from loguru import logger
+from satori import User, Guild, Member, Channel
+
+from .uid import uid_index
+from .repository import EntityRepository
+
+ENTITY_KINDS: Dict[str, Callable[[dict], Any]] = {
+    "guild": Guild.parse,
+    "channel": Channel.parse,
+    "user": User.parse,
+    "member": Member.parse,
+}
+# guild-list/friend-list 的 id 列表
+LISTING_KIND = "listing"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uid (uin INTEGER PRIMARY KEY, uid TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS entity (
+    key TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+"""
+
+
+# (kind, key, 存入时间, 值), 值在写入线程中序列化
+_Entity = Tuple[str, Any, float, Any]
+
+
+class WarmStore:
+    """将 uid 映射与 guild/channel/user/member 缓存快照到 `bots/<uin>/cache.db`, 用于重启后快速预热
+
+    每次 flush 只写入上次之后变更的条目, 写入失败的条目合并到下一次
+    """
+
+    def __init__(self, path: Path, flush_interval: float = 60, max_age: timedelta = timedelta(days=1)):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_age = max_age
+        self._lock = asyncio.Lock()
+        self._uids: Dict[int, Optional[str]] = {}
+        self._entities: Dict[Tuple[str, Any], _Entity] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.executescript(_SCHEMA)
+        return conn
+
+    def _read(self) -> Tuple[List[Tuple[int, str]], List[Tuple[str, str, str, float]]]:
+        conn = self._connect()
+        try:
+            uids = conn.execute("SELECT uin, uid FROM uid").fetchall()
+            entities = conn.execute(
+                "SELECT key, kind, data, updated FROM entity WHERE updated >= ?",
+                (time.time() - self.max_age.total_seconds(),),
+            ).fetchall()
+        finally:
+            conn.close()
+        return uids, entities
+
+    @staticmethod
+    def _dump(kind: str, key: Any, stored_at: float, value: Any) -> Tuple[str, str, str, float]:
+        data = value if kind == LISTING_KIND else value.dump()
+        return json.dumps(key), kind, json.dumps(data, ensure_ascii=False), stored_at
+
+    def _write(self, uids: Dict[int, Optional[str]], entities: List[_Entity]) -> None:
+        rows = [self._dump(*entity) for entity in entities]
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO uid (uin, uid) VALUES (?, ?)",
+                    [(uin, uid) for uin, uid in uids.items() if uid is not None],
+                )
+                conn.executemany(
+                    "DELETE FROM uid WHERE uin = ?", [(uin,) for uin, uid in uids.items() if uid is None]
+                )
+                conn.executemany("INSERT OR REPLACE INTO entity VALUES (?, ?, ?, ?)", rows)
+                conn.execute(
+                    "DELETE FROM entity WHERE updated < ?",
+                    (time.time() - self.max_age.total_seconds(),),
+                )
+        finally:
+            conn.close()
+
+    async def restore(self, repo: EntityRepository) -> None:
+        if not self.path.exists():
+            return
+        try:
+            uids, rows = await asyncio.to_thread(self._read)
+        except sqlite3.Error as e:
+            logger.warning(f"failed to load warm store {self.path}: {e!r}")
+            return
+        uid_index.load(uids)
+        tables = {**repo.tables(), LISTING_KIND: repo.listings}
+        entries: Dict[str, list] = {kind: [] for kind in tables}
+        for key, kind, data, updated in rows:
+            if kind not in tables:
+                continue
+            try:
+                parsed_key = json.loads(key)
+                value = json.loads(data)
+                if kind in ENTITY_KINDS:
+                    value = ENTITY_KINDS[kind](value)
+                elif not isinstance(value, list):
+                    continue
+            except (ValueError, TypeError, KeyError):
+                continue
+            entries[kind].append(
+                (tuple(parsed_key) if isinstance(parsed_key, list) else parsed_key, updated, value)
+            )
+        restored = sum(tables[kind].load(items) for kind, items in entries.items())
+        logger.debug(f"warm store restored {len(uids)} uid(s) and {restored} entity(s)")
+
+    async def flush(self, repo: EntityRepository) -> None:
+        repo.purge()
+        tables = {**repo.tables(), LISTING_KIND: repo.listings}
+        async with self._lock:
+            self._uids.update(uid_index.take_changes())
+            for kind, table in tables.items():
+                for key, stored_at, value in table.take_changed():
+                    self._entities[(kind, key)] = (kind, key, stored_at, value)
+            if not (self._uids or self._entities):
+                return
+            uids, entities = self._uids, list(self._entities.values())
+            try:
+                await asyncio.to_thread(self._write, uids, entities)
+            except sqlite3.Error as e:
+                logger.warning(f"failed to flush warm store {self.path}: {e!r}")
+                return
+            self._uids, self._entities = {}, {}
+        logger.trace(f"warm store flushed {len(uids)} uid change(s) and {len(entities)} entity(s)")
+
+    async def run(self, repo: EntityRepository) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush(repo)
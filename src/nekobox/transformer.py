@@ -1,13 +1,32 @@
 import os
 import sys
 import json
+import mmap
 import time
 import base64
+import asyncio
+import binascii
 from io import BytesIO
 from pathlib import Path
+from functools import partial
+from dataclasses import dataclass
+from collections import defaultdict
 from html import unescape as html_unescape
 from urllib.parse import quote, unquote, unquote_to_bytes
-from typing import TYPE_CHECKING, List, Tuple, Union, Optional
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    List,
+    Tuple,
+    Union,
+    Literal,
+    TypeVar,
+    BinaryIO,
+    Callable,
+    Optional,
+    Awaitable,
+    FrozenSet,
+)
 
 from yarl import URL
 from loguru import logger
@@ -39,12 +58,24 @@ from lagrange.client.message.elems import (
     ForwardNode,
 )
 
+from .uid import resolve_uin
 from .consts import PLATFORM, get_server
-from .utils import get_public_ip, transform_audio, download_resource
+from .msgstore import forwards, messages
+from .mediacache import UploadCache, CachedFileResponse, uploads
+from .utils import (
+    TimingStats,
+    get_public_ip,
+    transform_audio,
+    download_to_file,
+    download_resource,
+    check_resource_size,
+)
 
 if TYPE_CHECKING:
     from lagrange.client.client import Client
 
+C = TypeVar("C", bound=Callable[..., Awaitable])
+
 
 def encode_data_url(data: Union[str, bytes], mime_type=""):
     if isinstance(data, str):
@@ -57,113 +88,306 @@ def encode_data_url(data: Union[str, bytes], mime_type=""):
     return f"data:{mime_type},{encoded}"
 
 
-def decode_data_url(url: str) -> Tuple[str, bytes]:
+# base64 按块解码的块大小(需为 4 的倍数), 以及转到线程中解码的 data url 长度阈值
+DATA_URL_CHUNK = 256 * 1024
+DATA_URL_OFFLOAD = 256 * 1024
+
+
+def decode_data_url_into(url: str, sink: BinaryIO) -> str:
+    """将 data url 解码写入 `sink`, 返回 mime
+
+    base64 内容按块解码, 不复制整段 payload, 解码前按估算大小检查资源上限
+    """
     if url.find("data:") != 0:
         raise ValueError("Not a valid Data URL")
-    head, data = url[5:].split(",", 1)
+    start = url.index(",") + 1
+    head = url[5 : start - 1]
     if head.find(";") != -1:
         mime, enc_type = head.split(";", 1)
-        if enc_type == "base64":
-            decoded = base64.b64decode(data)
-        else:
+        if enc_type != "base64":
             raise TypeError(f"Type {enc_type} not supported")
+        check_resource_size((len(url) - start) * 3 // 4)
+        if any(ws in url for ws in (" ", "\n", "\r", "\t")):
+            # 含空白时按块切分会错位, 整体解码
+            sink.write(base64.b64decode(url[start:]))
+        else:
+            for offset in range(start, len(url), DATA_URL_CHUNK):
+                sink.write(binascii.a2b_base64(url[offset : offset + DATA_URL_CHUNK]))
     else:
         mime = head
-        decoded = unquote(data).encode()
-    return mime, decoded
+        sink.write(unquote(url[start:]).encode())
+    return mime
+
+
+def decode_data_url(url: str) -> Tuple[str, bytes]:
+    buf = BytesIO()
+    mime = decode_data_url_into(url, buf)
+    return mime, buf.getvalue()
+
+
+async def _decode_data_url_into(url: str, sink: BinaryIO) -> str:
+    if len(url) > DATA_URL_OFFLOAD:
+        return await asyncio.to_thread(decode_data_url_into, url, sink)
+    return decode_data_url_into(url, sink)
+
+
+# 超过该大小的本地文件以 mmap 映射后交给上传接口, 不整体读入内存
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def _file_url_to_path(url: str) -> Path:
+    if sys.version_info >= (3, 13):
+        path = Path.from_uri(url)
+    else:
+        decoded = os.fsdecode(unquote_to_bytes(url[8:] if sys.platform == "win32" else url[7:]))
+        path = Path(decoded)
+    if not path.exists():
+        raise FileNotFoundError(f"File not found: {path.absolute()}")
+    return path
+
+
+def _read_file(path: Path) -> bytes:
+    check_resource_size(path.stat().st_size)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _open_file(path: Path) -> BinaryIO:
+    size = path.stat().st_size
+    check_resource_size(size)
+    with open(path, "rb") as f:
+        if size >= MMAP_THRESHOLD:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # type: ignore
+        return BytesIO(f.read())
+
+
+async def _fetch_internal(url: str):
+    server = get_server()
+    if not server:
+        raise ValueError("No server found")
+    return await server.fetch_proxy(url)
 
 
 async def parse_resource(url: str) -> bytes:
     logger.debug(f"loading resource: {url[:80]}")
     if url.startswith("internal:"):
-        server = get_server()
-        if not server:
-            raise ValueError("No server found")
-        resp = await server.fetch_proxy(url)
+        resp = await _fetch_internal(url)
         if isinstance(resp, FileResponse):
-            with open(resp.path, "rb") as f:
-                return f.read()
+            try:
+                return await asyncio.to_thread(_read_file, Path(resp.path))
+            finally:
+                if isinstance(resp, CachedFileResponse):
+                    resp.release()
         return bytes(resp.body)
     if url.find("http") == 0:
         return await download_resource(url)
     elif url.find("data") == 0:
-        _, data = decode_data_url(url)
-        return data
+        buf = BytesIO()
+        await _decode_data_url_into(url, buf)
+        return buf.getvalue()
     elif url.find("file://") == 0:
-        if sys.version_info >= (3, 13):
-            path = Path.from_uri(url)
-        else:
-            decoded = os.fsdecode(unquote_to_bytes(url[8:] if sys.platform == "win32" else url[7:]))
-            path = Path(decoded)
-        if not path.exists():
-            raise FileNotFoundError(f"File not found: {path.absolute()}")
-        with open(path, "rb") as f:
-            return f.read()
+        return await asyncio.to_thread(_read_file, _file_url_to_path(url))
     else:
         raise ValueError(f"Unsupported URL: {url}")
 
 
+async def open_resource(url: str) -> BinaryIO:
+    """与 `parse_resource` 相同, 但返回可直接交给上传接口的文件对象
+
+    远程资源流式下载到临时文件, 本地文件在线程中打开, 较大时使用 mmap, 均不额外复制内容
+    """
+    if url.startswith("internal:"):
+        logger.debug(f"loading resource: {url[:80]}")
+        resp = await _fetch_internal(url)
+        if isinstance(resp, FileResponse):
+            try:
+                return await asyncio.to_thread(_open_file, Path(resp.path))
+            finally:
+                if isinstance(resp, CachedFileResponse):
+                    resp.release()
+        return BytesIO(resp.body)
+    if url.find("http") == 0:
+        return await download_to_file(url)
+    elif url.find("file://") == 0:
+        return await asyncio.to_thread(_open_file, _file_url_to_path(url))
+    elif url.find("data") == 0:
+        # 直接解码到交给上传接口的缓冲区
+        buf = BytesIO()
+        await _decode_data_url_into(url, buf)
+        buf.seek(0)
+        return buf
+    return BytesIO(await parse_resource(url))
+
+
+class ConverterTable:
+    """按元素类型注册的转换函数表
+
+    查找时沿 MRO 匹配, 结果按具体类型缓存; 转换次数与耗时按类型名记录在 `stats` 中,
+    纯文本/at 消息走快速路径, 整条消息记录为 `fast-path`
+    """
+
+    def __init__(self):
+        self.stats: Dict[str, TimingStats] = defaultdict(TimingStats)
+        self._table: Dict[type, Callable[..., Awaitable]] = {}
+        self._resolved: Dict[type, Optional[Callable[..., Awaitable]]] = {}
+
+    def register(self, *types: type):
+        def wrapper(func: C) -> C:
+            for typ in types:
+                self._table[typ] = func
+            self._resolved.clear()
+            return func
+
+        return wrapper
+
+    def lookup(self, typ: type) -> Optional[Callable[..., Awaitable]]:
+        try:
+            return self._resolved[typ]
+        except KeyError:
+            func = next((self._table[base] for base in typ.__mro__ if base in self._table), None)
+            self._resolved[typ] = func
+            return func
+
+
+# lagrange -> satori
+inbound = ConverterTable()
+# satori -> lagrange
+outbound = ConverterTable()
+
+
+def _only(msgs: list, types: FrozenSet[type]) -> bool:
+    for m in msgs:
+        if type(m) not in types:
+            return False
+    return True
+
+
+@dataclass
+class _InboundContext:
+    self_uin: int
+    gid: Optional[int]
+    uid: Optional[str]
+    client: "Client | None"
+    budget: "Optional[_ForwardBudget]" = None
+
+    def forward_budget(self) -> "_ForwardBudget":
+        # 同一事件内的所有合并转发共享一份预算
+        if self.budget is None:
+            self.budget = _ForwardBudget(FORWARD_MAX_NODES)
+        return self.budget
+
+
+_INBOUND_FAST = frozenset((Text, At))
+
+
 async def msg_to_satori(
     msgs: List[Element],
     self_uin: int,
     gid=None,
     uid=None,
     client: "Client | None" = None,
+    _budget: "Optional[_ForwardBudget]" = None,
 ) -> List[SatoriElement]:
+    if _only(msgs, _INBOUND_FAST):
+        start = time.perf_counter()
+        fast = [SatoriText(m.text) if type(m) is Text else SatoriAt(str(m.uin), m.text) for m in msgs]
+        inbound.stats["fast-path"].record(time.perf_counter() - start)
+        return fast
+
+    ctx = _InboundContext(self_uin, gid, uid, client, _budget)
     new_msg: List[SatoriElement] = []
     for m in msgs:
-        if isinstance(m, At):
-            new_msg.append(SatoriAt(str(m.uin), m.text))
-        elif isinstance(m, AtAll):
-            new_msg.append(SatoriAt.all())
-        elif isinstance(m, Quote):
-            new_msg.append(SatoriQuote(str(m.seq))(SatoriAuthor(str(m.uin)), m.msg))
-        elif isinstance(m, (Image, MarketFace)):
-            url = URL(m.url.replace("&amp;", "&"))
-            if "rkey" in url.query:
-                url = url.with_query({k: v for k, v in url.query.items() if k != "rkey"})
-                if server := get_server():
-                    url = URL(server.url_base) / "proxy" / str(url)
-                    if url.host == "0.0.0.0":
-                        url = url.with_host(get_public_ip())
-            new_msg.append(SatoriImage.of(str(url), extra={"width": m.width, "height": m.height}))
-        elif isinstance(m, Audio):
-            assert gid or uid, "gid or uid must be specified"
-            new_msg.append(
-                SatoriAudio(
-                    f"internal:{PLATFORM}/{self_uin}"
-                    f"/audio/{'gid' if gid else 'uid'}/{gid or uid}/{m.file_key}",
-                    title=m.text,
-                    duration=m.time,
-                )
-            )
-        elif isinstance(m, Text):
-            new_msg.append(SatoriText(m.text))
-        elif isinstance(m, MulitMsg):
-            new_msg.append(await _forward_to_satori(m, self_uin, gid=gid, uid=uid, client=client))
-        elif isinstance(m, Json):
-            try:
-                payload = m.to_dict()
-            except (UnicodeDecodeError, json.JSONDecodeError):
-                logger.warning("cannot parse json message to satori " + repr(m)[:100])
-                continue
-            if forward_msg := _multimsg_from_json_payload(payload):
-                new_msg.append(
-                    await _forward_to_satori(
-                        forward_msg,
-                        self_uin,
-                        gid=gid,
-                        uid=uid,
-                        client=client,
-                    )
-                )
-            else:
-                logger.warning("cannot parse json message to satori " + repr(m)[:100])
-        else:
+        typ = type(m)
+        if (convert := inbound.lookup(typ)) is None:
             logger.warning("cannot parse message to satori " + repr(m)[:100])
+            continue
+        start = time.perf_counter()
+        elem = await convert(m, ctx)
+        inbound.stats[typ.__name__].record(time.perf_counter() - start)
+        if elem is not None:
+            new_msg.append(elem)
     return new_msg
 
 
+@inbound.register(Text)
+async def _text_to_satori(m: Text, ctx: _InboundContext) -> SatoriElement:
+    return SatoriText(m.text)
+
+
+@inbound.register(At)
+async def _at_to_satori(m: At, ctx: _InboundContext) -> SatoriElement:
+    return SatoriAt(str(m.uin), m.text)
+
+
+@inbound.register(AtAll)
+async def _at_all_to_satori(m: AtAll, ctx: _InboundContext) -> SatoriElement:
+    return SatoriAt.all()
+
+
+@inbound.register(Quote)
+async def _quote_to_satori(m: Quote, ctx: _InboundContext) -> SatoriElement:
+    return SatoriQuote(str(m.seq))(SatoriAuthor(str(m.uin)), m.msg)
+
+
+_proxy_base: Optional[Tuple[object, URL]] = None
+
+
+def _proxy_url_base(server) -> URL:
+    """server 的 proxy 路由地址, 监听 0.0.0.0 时替换为本机地址; 按 server 缓存"""
+    global _proxy_base
+    if _proxy_base is None or _proxy_base[0] is not server:
+        base = URL(server.url_base) / "proxy"
+        if base.host == "0.0.0.0":
+            base = base.with_host(get_public_ip())
+        _proxy_base = (server, base)
+    return _proxy_base[1]
+
+
+@inbound.register(Image, MarketFace)
+async def _image_to_satori(m: Union[Image, MarketFace], ctx: _InboundContext) -> SatoriElement:
+    src = m.url.replace("&amp;", "&")
+    # 只有带 rkey 的地址需要改写, 其余直接使用
+    if "rkey" in src:
+        url = URL(src)
+        if "rkey" in url.query:
+            url = url.with_query({k: v for k, v in url.query.items() if k != "rkey"})
+            if server := get_server():
+                url = _proxy_url_base(server) / str(url)
+        src = str(url)
+    return SatoriImage.of(src, extra={"width": m.width, "height": m.height})
+
+
+@inbound.register(Audio)
+async def _audio_to_satori(m: Audio, ctx: _InboundContext) -> SatoriElement:
+    assert ctx.gid or ctx.uid, "gid or uid must be specified"
+    return SatoriAudio(
+        f"internal:{PLATFORM}/{ctx.self_uin}"
+        f"/audio/{'gid' if ctx.gid else 'uid'}/{ctx.gid or ctx.uid}/{m.file_key}",
+        title=m.text,
+        duration=m.time,
+    )
+
+
+@inbound.register(MulitMsg)
+async def _multimsg_to_satori(m: MulitMsg, ctx: _InboundContext) -> SatoriElement:
+    return await _forward_to_satori(
+        m, ctx.self_uin, gid=ctx.gid, uid=ctx.uid, client=ctx.client, budget=ctx.forward_budget()
+    )
+
+
+@inbound.register(Json)
+async def _json_to_satori(m: Json, ctx: _InboundContext) -> Optional[SatoriElement]:
+    try:
+        payload = m.to_dict()
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        logger.warning("cannot parse json message to satori " + repr(m)[:100])
+        return None
+    if forward_msg := _multimsg_from_json_payload(payload):
+        return await _multimsg_to_satori(forward_msg, ctx)
+    logger.warning("cannot parse json message to satori " + repr(m)[:100])
+    return None
+
+
 def _multimsg_from_json_payload(payload: object) -> Optional[MulitMsg]:
     if not isinstance(payload, dict) or payload.get("app") != "com.tencent.multimsg":
         return None
@@ -208,6 +432,54 @@ def _normalize_avatar_url(avatar: str | None, uin: int = 0) -> str:
     return ""
 
 
+# 入站合并转发的展开方式: eager 在事件中逐层拉取并展开, lazy 只输出带 resid 的占位, 由 internal 接口按需展开
+forward_mode: Literal["eager", "lazy"] = "eager"
+# 单个事件中合并转发的最大展开层数与节点总数, 超出部分输出为占位
+FORWARD_MAX_DEPTH = 3
+FORWARD_MAX_NODES = 200
+
+
+def set_forward_options(
+    mode: Optional[Literal["eager", "lazy"]] = None,
+    max_depth: Optional[int] = None,
+    max_nodes: Optional[int] = None,
+) -> None:
+    global forward_mode, FORWARD_MAX_DEPTH, FORWARD_MAX_NODES
+    if mode is not None:
+        forward_mode = mode
+    if max_depth is not None:
+        FORWARD_MAX_DEPTH = max_depth
+    if max_nodes is not None:
+        FORWARD_MAX_NODES = max_nodes
+
+
+@dataclass
+class _ForwardBudget:
+    """一次转换中剩余可展开的节点数与当前嵌套层数"""
+
+    nodes: int
+    depth: int = 0
+
+
+def _forward_src(self_uin: int, resid: str, gid=None, uid=None) -> str:
+    return f"internal:{PLATFORM}/{self_uin}/forward/{'gid' if gid else 'uid'}/{gid or uid}/{resid}"
+
+
+def _forward_message(
+    resid: Optional[str], file_name: Optional[str], nodes: List[SatoriMessage], src: Optional[str] = None
+) -> SatoriMessage:
+    forward = SatoriMessage(id=resid, forward=True, content=nodes)
+    # _attrs 非空时序列化不再读取 id/forward 字段, 需一并写入
+    if resid:
+        forward._attrs["id"] = resid
+    forward._attrs["forward"] = True
+    if file_name:
+        forward._attrs["file_name"] = file_name
+    if src:
+        forward._attrs["src"] = src
+    return forward
+
+
 async def _forward_to_satori(
     forward_msg: MulitMsg,
     self_uin: int,
@@ -215,33 +487,62 @@ async def _forward_to_satori(
     gid=None,
     uid=None,
     client: "Client | None" = None,
+    budget: Optional[_ForwardBudget] = None,
+    expand: bool = False,
 ) -> SatoriMessage:
-    if not forward_msg.messages and forward_msg.resid and client:
+    budget = budget or _ForwardBudget(FORWARD_MAX_NODES)
+    src = _forward_src(self_uin, forward_msg.resid, gid, uid) if forward_msg.resid and (gid or uid) else None
+    if budget.depth >= FORWARD_MAX_DEPTH or budget.nodes <= 0:
+        return _forward_message(forward_msg.resid, forward_msg.file_name, [], src)
+    if not forward_msg.messages and forward_msg.resid:
+        if not client or (forward_mode == "lazy" and not expand):
+            return _forward_message(forward_msg.resid, forward_msg.file_name, [], src)
         try:
-            forward_msg = await client.get_forward_msg(forward_msg.resid, is_group=gid is not None)
+            fetched = await forwards.fetch(client, forward_msg.resid, gid is not None)
         except Exception:
             logger.exception("cannot fetch forward message {}", forward_msg.resid)
+            return _forward_message(forward_msg.resid, forward_msg.file_name, [], src)
+        forward_msg = MulitMsg(
+            resid=forward_msg.resid,
+            file_name=forward_msg.file_name or fetched.file_name,
+            messages=fetched.messages,
+        )
 
     nodes = []
-    for node in forward_msg.messages:
-        author = SatoriAuthor(
-            str(node.sender_uin),
-            node.sender_nick or None,
-            _normalize_avatar_url(node.sender_avatar_url, node.sender_uin) or None,
-        )
-        message = SatoriMessage(
-            content=[
-                author,
-                *await msg_to_satori(node.content, self_uin, gid=gid, uid=uid, client=client),
-            ]
-        )
-        message._attrs["timestamp"] = node.timestamp
-        nodes.append(message)
+    budget.depth += 1
+    try:
+        for node in forward_msg.messages:
+            if budget.nodes <= 0:
+                logger.debug("forward message {} truncated at {} node(s)", forward_msg.resid, len(nodes))
+                break
+            budget.nodes -= 1
+            author = SatoriAuthor(
+                str(node.sender_uin),
+                node.sender_nick or None,
+                _normalize_avatar_url(node.sender_avatar_url, node.sender_uin) or None,
+            )
+            message = SatoriMessage(
+                content=[
+                    author,
+                    *await msg_to_satori(
+                        node.content, self_uin, gid=gid, uid=uid, client=client, _budget=budget
+                    ),
+                ]
+            )
+            message._attrs["timestamp"] = node.timestamp
+            nodes.append(message)
+    finally:
+        budget.depth -= 1
+
+    truncated = len(nodes) < len(forward_msg.messages)
+    return _forward_message(forward_msg.resid, forward_msg.file_name, nodes, src if truncated else None)
 
-    forward = SatoriMessage(id=forward_msg.resid, forward=True, content=nodes)
-    if forward_msg.file_name:
-        forward._attrs["file_name"] = forward_msg.file_name
-    return forward
+
+async def expand_forward(client: "Client", self_uin: int, resid: str, gid=None, uid=None) -> SatoriMessage:
+    """展开 lazy 模式或超出限制时输出的合并转发占位, 内部嵌套的转发仍按当前模式处理"""
+    return await _forward_to_satori(
+        MulitMsg(resid=resid), self_uin, gid=gid, uid=uid, client=client, expand=True
+    )
 
 
 def _author_name(author: SatoriAuthor) -> str:
@@ -380,55 +681,224 @@ async def satori_to_forward_msg(
     return await _forward_to_msg(client, message, grp_id=grp_id, uid=uid)
 
 
+async def _build_quote(client: "Client", seq: int, *, grp_id=0, uid="") -> Quote:
+    if grp_id:
+        stored = await messages.of(client).get(1, grp_id, seq)
+    else:
+        try:
+            stored = await messages.of(client).get(2, resolve_uin(uid), seq)
+        except ValueError:
+            stored = None
+    if stored and stored.uid:
+        return Quote(seq=stored.seq, uin=stored.uin, timestamp=stored.time, uid=stored.uid, msg=stored.text)
+    target = await client.get_grp_msg(grp_id, seq)
+    return Quote.build(target[0])
+
+
+class MediaUploadError(Exception):
+    """消息中的部分媒体资源处理失败"""
+
+    def __init__(self, failures: List[Tuple[int, str, BaseException]]):
+        self.failures = failures
+        detail = "; ".join(f"#{index} {src[:80]}: {exc!r}" for index, src, exc in failures)
+        super().__init__(f"{len(failures)} media element(s) failed: {detail}")
+
+
+# 同一条消息中并发处理的媒体数量, <= 1 时按顺序处理
+_media_concurrency = 4
+
+
+def set_media_concurrency(limit: int) -> None:
+    global _media_concurrency
+    _media_concurrency = limit
+
+
+async def _digest_resource(cache: UploadCache, data: BinaryIO) -> str:
+    try:
+        return await asyncio.to_thread(cache.digest, data)
+    except BaseException:
+        data.close()
+        raise
+
+
+async def _upload_image(client: "Client", src: str, grp_id: int, uid: str) -> Image:
+    data = await open_resource(src)
+
+    async def upload() -> Image:
+        if grp_id:
+            return await client.upload_grp_image(data, grp_id)
+        elif uid:
+            return await client.upload_friend_image(data, uid)
+        raise AssertionError
+
+    cache = uploads.of(client)
+    digest = await _digest_resource(cache, data)
+    # data 交由上传任务关闭, 本协程被取消时不影响等待同一上传的其他请求
+    return await cache.upload(("image", grp_id, uid, digest), upload, data)
+
+
+async def _upload_audio(client: "Client", src: str, grp_id: int, uid: str) -> Audio:
+    raw = await open_resource(src)
+
+    async def upload() -> Audio:
+        data = await transform_audio(raw)
+        if grp_id:
+            return await client.upload_grp_audio(data, grp_id)
+        elif uid:
+            return await client.upload_friend_audio(data, uid)
+        raise AssertionError
+
+    # 以转码前的内容为键, 命中时同时省去转码
+    cache = uploads.of(client)
+    digest = await _digest_resource(cache, raw)
+    return await cache.upload(("audio", grp_id, uid, digest), upload, raw)
+
+
+# (占位下标, 资源地址, 元素类型名, 上传协程工厂)
+_MediaJob = Tuple[int, str, str, Callable[[], Awaitable[Element]]]
+
+
+async def _resolve_media(new_msg: List[Element], jobs: List[_MediaJob]) -> None:
+    sem = asyncio.Semaphore(max(_media_concurrency, 1))
+
+    async def run(name: str, factory: Callable[[], Awaitable[Element]]) -> Element:
+        async with sem:
+            # 只计上传本身, 不含等待信号量的时间
+            start = time.perf_counter()
+            try:
+                return await factory()
+            finally:
+                outbound.stats[name].record(time.perf_counter() - start)
+
+    results = await asyncio.gather(
+        *(run(name, factory) for _, _, name, factory in jobs), return_exceptions=True
+    )
+    failures = []
+    for (index, src, _, _), res in zip(jobs, results):
+        if isinstance(res, BaseException):
+            if not isinstance(res, Exception):
+                raise res
+            failures.append((index, src, res))
+        else:
+            new_msg[index] = res
+    if failures:
+        raise MediaUploadError(failures)
+
+
+@dataclass
+class _OutboundContext:
+    client: "Client"
+    new_msg: List[Element]
+    jobs: List[_MediaJob]
+    grp_id: int
+    uid: str
+
+
+_OUTBOUND_FAST = frozenset((SatoriText, SatoriAt))
+_DEFERRED = object()
+
+
+def _from_satori_at(m: SatoriAt) -> Optional[Element]:
+    if m.type:
+        return AtAll("@全体成员")
+    if m.id:
+        return At(f"@{m.name or m.id}", int(m.id), "")
+    return None
+
+
 async def satori_to_msg(client: "Client", msgs: List[SatoriElement], *, grp_id=0, uid="") -> List[Element]:
     new_msg: List[Element] = []
+    if _only(msgs, _OUTBOUND_FAST):
+        start = time.perf_counter()
+        for m in msgs:
+            if type(m) is SatoriText:
+                new_msg.append(Text(m.text))
+            elif (elem := _from_satori_at(m)) is not None:  # type: ignore
+                new_msg.append(elem)
+        outbound.stats["fast-path"].record(time.perf_counter() - start)
+        return new_msg
+
+    jobs: List[_MediaJob] = []
+    await _satori_to_msg(_OutboundContext(client, new_msg, jobs, grp_id, uid), msgs)
+    if jobs:
+        await _resolve_media(new_msg, jobs)
+    return new_msg
+
+
+async def _satori_to_msg(ctx: _OutboundContext, msgs: List[SatoriElement]) -> None:
+    """将元素追加到 `ctx.new_msg`, 媒体元素先放入占位并登记到 `ctx.jobs`, 由 `_resolve_media` 统一并发处理"""
     for m in msgs:
-        if isinstance(m, SatoriAt):
-            if m.type:
-                new_msg.append(AtAll("@全体成员"))
-            elif m.id:
-                new_msg.append(At(f"@{m.name or m.id}", int(m.id), ""))
-        elif isinstance(m, SatoriQuote):
-            target = await client.get_grp_msg(grp_id, int(m.id or 0))
-            new_msg.append(Quote.build(target[0]))
-        elif isinstance(m, SatoriImage):
-            data = await parse_resource(m.src)
-            if grp_id:
-                new_msg.append(await client.upload_grp_image(BytesIO(data), grp_id))
-            elif uid:
-                new_msg.append(await client.upload_friend_image(BytesIO(data), uid))
-            else:
-                raise AssertionError
-        elif isinstance(m, SatoriText):
-            new_msg.append(Text(m.text))
-        elif isinstance(m, SatoriLink):
-            parsed = await satori_to_msg(client, m._children, grp_id=grp_id, uid=uid)
-            new_msg.extend(parsed)
-            new_msg.append(Text(f"{': ' if parsed else ''}{m.url}"))
-        elif isinstance(m, (SatoriMessage, SatoriStyle)):
-            if isinstance(m, SatoriBr):
-                new_msg.append(Text("\n"))
-            elif isinstance(m, SatoriMessage) and m.forward:
-                forward_msg = await _forward_to_msg(client, m, grp_id=grp_id, uid=uid)
-                if forward_msg:
-                    new_msg.append(forward_msg)
-            else:
-                new_msg.extend(await satori_to_msg(client, m._children, grp_id=grp_id, uid=uid))
-                if isinstance(m, SatoriParagraph):
-                    new_msg.append(Text("\n"))
-        elif isinstance(m, SatoriAudio):
-            data = await transform_audio(BytesIO(await parse_resource(m.src)))
-            if grp_id:
-                new_msg.append(await client.upload_grp_audio(data, grp_id))
-            elif uid:
-                new_msg.append(await client.upload_friend_audio(data, uid))
-            else:
-                raise AssertionError
-        elif isinstance(m, SatoriCustom):
-            if m.type == "template":
-                new_msg.extend(await satori_to_msg(client, m._children, grp_id=grp_id, uid=uid))
-            else:
-                logger.warning("unknown message type on Custom: {}", m.type)
-        else:
+        typ = type(m)
+        if (convert := outbound.lookup(typ)) is None:
             logger.warning("cannot trans message to lag " + repr(m)[:100])
-    return new_msg
+            continue
+        start = time.perf_counter()
+        # 延后上传的媒体元素由 `_resolve_media` 按实际上传耗时记录
+        if await convert(m, ctx) is not _DEFERRED:
+            outbound.stats[typ.__name__].record(time.perf_counter() - start)
+
+
+@outbound.register(SatoriText)
+async def _text_to_msg(m: SatoriText, ctx: _OutboundContext) -> None:
+    ctx.new_msg.append(Text(m.text))
+
+
+@outbound.register(SatoriAt)
+async def _at_to_msg(m: SatoriAt, ctx: _OutboundContext) -> None:
+    if (elem := _from_satori_at(m)) is not None:
+        ctx.new_msg.append(elem)
+
+
+@outbound.register(SatoriQuote)
+async def _quote_to_msg(m: SatoriQuote, ctx: _OutboundContext) -> None:
+    ctx.new_msg.append(await _build_quote(ctx.client, int(m.id or 0), grp_id=ctx.grp_id, uid=ctx.uid))
+
+
+@outbound.register(SatoriImage, SatoriAudio)
+async def _media_to_msg(m: Union[SatoriImage, SatoriAudio], ctx: _OutboundContext) -> Optional[object]:
+    if not (ctx.grp_id or ctx.uid):
+        raise AssertionError
+    upload = _upload_image if isinstance(m, SatoriImage) else _upload_audio
+    factory = partial(upload, ctx.client, m.src, ctx.grp_id, ctx.uid)
+    if _media_concurrency <= 1:
+        try:
+            ctx.new_msg.append(await factory())
+        except Exception as e:
+            raise MediaUploadError([(len(ctx.new_msg), m.src, e)]) from e
+    else:
+        ctx.jobs.append((len(ctx.new_msg), m.src, type(m).__name__, factory))
+        ctx.new_msg.append(None)  # type: ignore
+        return _DEFERRED
+    return None
+
+
+@outbound.register(SatoriLink)
+async def _link_to_msg(m: SatoriLink, ctx: _OutboundContext) -> None:
+    before = len(ctx.new_msg)
+    await _satori_to_msg(ctx, m._children)
+    ctx.new_msg.append(Text(f"{': ' if len(ctx.new_msg) > before else ''}{m.url}"))
+
+
+@outbound.register(SatoriBr)
+async def _br_to_msg(m: SatoriBr, ctx: _OutboundContext) -> None:
+    ctx.new_msg.append(Text("\n"))
+
+
+@outbound.register(SatoriMessage, SatoriStyle)
+async def _container_to_msg(m: Union[SatoriMessage, SatoriStyle], ctx: _OutboundContext) -> None:
+    if isinstance(m, SatoriMessage) and m.forward:
+        forward_msg = await _forward_to_msg(ctx.client, m, grp_id=ctx.grp_id, uid=ctx.uid)
+        if forward_msg:
+            ctx.new_msg.append(forward_msg)
+        return
+    await _satori_to_msg(ctx, m._children)
+    if isinstance(m, SatoriParagraph):
+        ctx.new_msg.append(Text("\n"))
+
+
+@outbound.register(SatoriCustom)
+async def _custom_to_msg(m: SatoriCustom, ctx: _OutboundContext) -> None:
+    if m.type == "template":
+        await _satori_to_msg(ctx, m._children)
+    else:
+        logger.warning("unknown message type on Custom: {}", m.type)
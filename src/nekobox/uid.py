@@ -1,21 +1,122 @@
-from typing import Dict
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Dict, Tuple, Iterable, Iterator, Optional
 
-uid_dict: Dict[int, str] = {}
+DEFAULT_CAPACITY = 200_000
+
+
+@dataclass
+class UidIndexStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class UidIndex:
+    """uin <-> uid 双向索引, 超出容量时按 LRU 淘汰"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.stats = UidIndexStats()
+        self._uin2uid: "OrderedDict[int, str]" = OrderedDict()
+        self._uid2uin: Dict[str, int] = {}
+        # 上次 take_changes 之后的变更, 值为 None 表示已移除
+        self._changes: Dict[int, Optional[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._uin2uid)
+
+    def __contains__(self, uin: int) -> bool:
+        return uin in self._uin2uid
+
+    def items(self) -> Iterator[Tuple[int, str]]:
+        return iter(list(self._uin2uid.items()))
+
+    def get_uid(self, uin: int) -> Optional[str]:
+        uid = self._uin2uid.get(uin)
+        if uid is None:
+            self.stats.misses += 1
+            return None
+        self._uin2uid.move_to_end(uin)
+        self.stats.hits += 1
+        return uid
+
+    def get_uin(self, uid: str) -> Optional[int]:
+        uin = self._uid2uin.get(uid)
+        if uin is None:
+            self.stats.misses += 1
+            return None
+        self._uin2uid.move_to_end(uin)
+        self.stats.hits += 1
+        return uin
+
+    def put(self, uin: int, uid: str) -> None:
+        old_uid = self._uin2uid.get(uin)
+        if old_uid is not None:
+            self._uin2uid.move_to_end(uin)
+            if old_uid == uid:
+                return
+            self._uid2uin.pop(old_uid, None)
+        old_uin = self._uid2uin.get(uid)
+        if old_uin is not None and old_uin != uin:
+            self._uin2uid.pop(old_uin, None)
+            self._changes[old_uin] = None
+        self._uin2uid[uin] = uid
+        self._uid2uin[uid] = uin
+        self._changes[uin] = uid
+        self._evict()
+
+    def load(self, items: Iterable[Tuple[int, str]]) -> int:
+        """载入外部快照, 跳过已有的 uin, 载入的条目不计为变更"""
+        count = 0
+        for uin, uid in items:
+            if uin in self._uin2uid or uid in self._uid2uin:
+                continue
+            self._uin2uid[uin] = uid
+            self._uid2uin[uid] = uin
+            count += 1
+        self._evict()
+        return count
+
+    def take_changes(self) -> Dict[int, Optional[str]]:
+        changes, self._changes = self._changes, {}
+        return changes
+
+    def resize(self, capacity: int) -> None:
+        if capacity <= 0:
+            raise ValueError(f"capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self._evict()
+
+    def clear(self) -> None:
+        self._changes.update(dict.fromkeys(self._uin2uid))
+        self._uin2uid.clear()
+        self._uid2uin.clear()
+
+    def _evict(self) -> None:
+        while len(self._uin2uid) > self.capacity:
+            uin, uid = self._uin2uid.popitem(last=False)
+            self._uid2uin.pop(uid, None)
+            self._changes[uin] = None
+            self.stats.evictions += 1
+
+
+uid_index = UidIndex()
 
 
 def resolve_uid(uin: int) -> str:
-    if uin in uid_dict:
-        return uid_dict[uin]
-    raise ValueError(f"uin {uin} not in uid_dict")
+    if (uid := uid_index.get_uid(uin)) is not None:
+        return uid
+    raise ValueError(f"uin {uin} not in uid_index")
 
 
 def resolve_uin(uid: str) -> int:
-    for k, v in uid_dict.items():
-        if v == uid:
-            return k
-    raise ValueError(f"uid {uid} not found in uid_dict")
+    if (uin := uid_index.get_uin(uid)) is not None:
+        return uin
+    raise ValueError(f"uid {uid} not found in uid_index")
 
 
 def save_uid(uin: int, uid: str) -> None:
-    if uin not in uid_dict:
-        uid_dict[uin] = uid
+    uid_index.put(uin, uid)
@@ -1,24 +1,33 @@
-import os
 import ssl
+import time
+import zlib
+import random
 import socket
 import asyncio
 import warnings
 from io import BytesIO
-from shutil import which
-from typing import BinaryIO
+from collections import deque
+from urllib.parse import urljoin
+from dataclasses import dataclass
+from shutil import which, copyfileobj
 from urllib.request import getproxies
-from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
+from typing import Dict, List, Deque, Tuple, TypeVar, BinaryIO, Callable, Optional, Awaitable, AsyncIterator
 
-from lagrange.utils.audio.enum import AudioType
 from loguru import logger
 from lagrange.utils.audio.decoder import decode
+from lagrange.utils.audio.enum import AudioType
 from lagrange.utils.httpcat import HttpCat, HttpResponse
 
 try:
-    from pysilk import async_encode_file, async_decode
+    from pysilk import decode as silk_decode
+    from pysilk import encode as silk_encode
 except ImportError:
-    async_encode_file = None
-    async_decode = None
+    silk_encode = None
+    silk_decode = None
+
+T = TypeVar("T")
 
 
 def get_public_ip():
@@ -33,7 +42,198 @@ def get_public_ip():
     return IP
 
 
+class ResourceTooLarge(ValueError):
+    pass
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# 超过该大小的下载内容落盘
+DOWNLOAD_SPOOL_SIZE = 4 * 1024 * 1024
+download_max_size = 64 * 1024 * 1024
+
+
+@dataclass
+class TimingStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def record(self, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+@dataclass
+class PoolStats:
+    opened: int = 0
+    reused: int = 0
+    closed: int = 0
+    handshakes: int = 0
+    handshake_time: float = 0.0  # 累计建连耗时(含代理 CONNECT 与 TLS 握手)
+
+
+@dataclass
+class PooledConnection:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    idle_since: float = 0.0
+    uses: int = 1
+
+    @property
+    def alive(self) -> bool:
+        return not (self.writer.is_closing() or self.reader.at_eof())
+
+
+# (host, port, ssl)
+PoolKey = Tuple[str, int, bool]
+
+
+class ConnectionPool:
+    """按 (host, port, ssl) 复用 keep-alive 连接, 经 HTTP 代理时复用已建立的隧道"""
+
+    def __init__(self, max_per_host: int = 8, idle_timeout: float = 30.0):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.stats = PoolStats()
+        self._idle: Dict[PoolKey, Deque[PooledConnection]] = {}
+        self._limits: Dict[PoolKey, asyncio.Semaphore] = {}
+        self._last_sweep = time.monotonic()
+
+    def __len__(self) -> int:
+        return sum(len(idle) for idle in self._idle.values())
+
+    def configure(self, max_per_host: Optional[int] = None, idle_timeout: Optional[float] = None) -> None:
+        if max_per_host is not None:
+            self.max_per_host = max_per_host
+            self._limits.clear()  # 仅对之后的请求生效
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+
+    def _close(self, conn: PooledConnection) -> None:
+        conn.writer.close()
+        self.stats.closed += 1
+
+    def _take_idle(self, key: PoolKey) -> Optional[PooledConnection]:
+        idle = self._idle.get(key)
+        now = time.monotonic()
+        while idle:
+            conn = idle.pop()  # 优先使用最近归还的连接
+            if now - conn.idle_since < self.idle_timeout and conn.alive:
+                return conn
+            self._close(conn)
+        return None
+
+    async def acquire(
+        self,
+        key: PoolKey,
+        opener: Callable[[], Awaitable[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]],
+        fresh: bool = False,
+    ) -> PooledConnection:
+        sem = self._limits.setdefault(key, asyncio.Semaphore(self.max_per_host))
+        await sem.acquire()
+        try:
+            if not fresh and (conn := self._take_idle(key)):
+                conn.uses += 1
+                self.stats.reused += 1
+                return conn
+            start = time.perf_counter()
+            reader, writer = await opener()
+            self.stats.handshakes += 1
+            self.stats.handshake_time += time.perf_counter() - start
+            self.stats.opened += 1
+            return PooledConnection(reader, writer)
+        except BaseException:
+            sem.release()
+            raise
+
+    def release(self, key: PoolKey, conn: PooledConnection, reusable: bool) -> None:
+        if sem := self._limits.get(key):
+            sem.release()
+        if reusable and conn.alive:
+            conn.idle_since = time.monotonic()
+            self._idle.setdefault(key, deque()).append(conn)
+        else:
+            self._close(conn)
+        self._sweep()
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        if now - self._last_sweep < self.idle_timeout:
+            return
+        self._last_sweep = now
+        for key, idle in list(self._idle.items()):
+            while idle and now - idle[0].idle_since >= self.idle_timeout:
+                self._close(idle.popleft())
+            if not idle:
+                del self._idle[key]
+
+    async def close(self) -> None:
+        for idle in self._idle.values():
+            while idle:
+                self._close(idle.popleft())
+        self._idle.clear()
+
+
+http_pool = ConnectionPool()
+
+# 复用的空闲连接可能已被服务端关闭, 通常在写入请求或读取状态行时才暴露
+STALE_CONNECTION_ERRORS = (ConnectionError, asyncio.IncompleteReadError)
+
+
 class HttpCatProxies(HttpCat):
+    """经 `http_pool` 复用连接的 HttpCat, 支持系统 HTTP 代理"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._conn: Optional[PooledConnection] = None
+        self._reusable = False
+
+    @property
+    def _pool_key(self) -> PoolKey:
+        return self.host, self.port, bool(self.ssl)
+
+    @staticmethod
+    def _keep_alive(rsp: HttpResponse) -> bool:
+        if rsp.header.get("Connection", "").lower() == "close":
+            return False
+        return "Content-Length" in rsp.header or rsp.header.get("Transfer-Encoding") == "chunked"
+
+    @classmethod
+    async def _read_all(cls, header: dict, reader: asyncio.StreamReader) -> bytes:
+        # HttpCat 的 chunked 解析未读取块尾 CRLF, 仅在 Connection: close 时可用
+        return b"".join([chunk async for chunk in cls._iter_body(header, reader)])
+
+    @classmethod
+    async def request(
+        cls,
+        method: str,
+        url: str,
+        header: Optional[Dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        cookies: Optional[Dict[str, str]] = None,
+        follow_redirect=True,
+        max_redirect=10,
+        conn_timeout=0,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> HttpResponse:
+        address, path, with_ssl = cls._parse_url(url)
+        async with cls(*address, headers=dict(header or {}), cookies=cookies, ssl=with_ssl) as req:
+            resp = await req.send_request(method, path, body, False, conn_timeout)
+        logger.trace(f"request({method})[{resp.code}]: {url}")
+        if resp.code // 100 == 3 and follow_redirect and max_redirect > 0:
+            return await cls.request(
+                method,
+                urljoin(url, resp.header["Location"]),
+                header,
+                body,
+                cookies,
+                follow_redirect,
+                max_redirect - 1,
+                conn_timeout,
+            )
+        return resp
+
     @classmethod
     async def _parse_proxy_response(cls, reader: asyncio.StreamReader) -> HttpResponse:
         stat = await cls._read_line(reader)
@@ -74,49 +274,375 @@ class HttpCatProxies(HttpCat):
         else:
             raise ConnectionError(f"proxy error: {rsp.code}")
 
+    async def _open(self, conn_timeout=0) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        proxies = getproxies()
+        if "http" in proxies:
+            await self.connect_http_proxy(proxies.get("http"), conn_timeout)
+            if self.ssl:
+                loop = asyncio.get_running_loop()
+                self._writer._protocol._over_ssl = True  # noqa, suppress warning
+                _transport = await loop.start_tls(
+                    self._writer.transport,
+                    self._writer.transport.get_protocol(),
+                    ssl.create_default_context(),
+                    server_side=False,
+                    server_hostname=self.host,
+                )
+                self._writer._transport = _transport
+            return self._reader, self._writer
+        open_conn = asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        if conn_timeout:
+            return await asyncio.wait_for(open_conn, conn_timeout)
+        return await open_conn
+
+    async def _connect(self, conn_timeout=0, fresh=False):
+        if self._reader and self._writer:
+            return
+        self._conn = await http_pool.acquire(self._pool_key, lambda: self._open(conn_timeout), fresh)
+        self._reader, self._writer = self._conn.reader, self._conn.writer
+
+    async def _reconnect(self, conn_timeout=0) -> bool:
+        """复用的连接失效时关闭它并换用新建的连接; 当前已是新建的连接时返回 False"""
+        if self._conn is None or self._conn.uses <= 1:
+            return False
+        logger.debug(f"stale pooled connection to {self.host}:{self.port}, reconnecting")
+        http_pool.release(self._pool_key, self._conn, False)
+        self._conn, self._reader, self._writer = None, None, None
+        await self._connect(conn_timeout, fresh=True)
+        return True
+
     async def send_request(
         self, method: str, path: str, body=None, follow_redirect=True, conn_timeout=0
     ) -> HttpResponse:
-        if not (self._reader and self._writer):
-            proxies = getproxies()
-            if "http" in proxies:
-                await self.connect_http_proxy(proxies.get("http"), conn_timeout)
-                if self.ssl:
-                    loop = asyncio.get_running_loop()
-                    self._writer._protocol._over_ssl = True  # noqa, suppress warning
-                    _transport = await loop.start_tls(
-                        self._writer.transport,
-                        self._writer.transport.get_protocol(),
-                        ssl.create_default_context(),
-                        server_side=False,
-                        server_hostname=self.host,
-                    )
-                    self._writer._transport = _transport
-        return await super().send_request(method, path, body, follow_redirect, conn_timeout)
+        self._reusable = False
+        await self._connect(conn_timeout)
+        while True:
+            try:
+                rsp = await super().send_request(method, path, body, follow_redirect, conn_timeout)
+                break
+            except STALE_CONNECTION_ERRORS:
+                if not await self._reconnect(conn_timeout):
+                    raise
+        self._reusable = self._keep_alive(rsp)
+        return rsp
+
+    async def stream_request(
+        self, method: str, path: str, sink: BinaryIO, max_size: int, conn_timeout=0
+    ) -> HttpResponse:
+        """发送请求并将(解压后的)响应体分块写入 `sink`, 返回的 HttpResponse 不含 body
 
+        3xx 与非 200 响应不读取 body, 由调用方处理
+        """
+        if self._stop_flag:
+            raise AssertionError("connection stopped")
+        self._reusable = False
+        await self._connect(conn_timeout)
+        while True:
+            reader, writer = self._reader, self._writer
+            try:
+                await self._request(
+                    self.host, reader, writer, method, path, self.header, cookies=self.cookie, wait_rsp=False
+                )
+                rsp = await self._parse_proxy_response(reader)
+                break
+            except STALE_CONNECTION_ERRORS:
+                # 尚未读取响应体, 可以安全地在新连接上重发
+                if not await self._reconnect(conn_timeout):
+                    raise
+        length = int(rsp.header.get("Content-Length", 0))
+        if rsp.code != 200:
+            # 重定向等响应体较小, 读完后连接可继续复用
+            if "Content-Length" in rsp.header and length <= DOWNLOAD_CHUNK_SIZE:
+                await reader.readexactly(length)
+                self._reusable = self._keep_alive(rsp)
+            return rsp
+        if length > max_size:
+            raise ResourceTooLarge(f"Content-Length {length} exceeds limit {max_size}")
+        await self._stream_body(rsp.header, reader, sink, max_size)
+        self._reusable = self._keep_alive(rsp)
+        return rsp
 
-async def download_resource(url: str, retry=5, timeout=10) -> bytes:
-    if retry > 0:
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._conn is None:
+            return await super().__aexit__(exc_type, exc_val, exc_tb)
+        self._stop_flag = True
+        http_pool.release(self._pool_key, self._conn, self._reusable and exc_type is None)
+        self._conn, self._reader, self._writer = None, None, None
+
+    @classmethod
+    async def _iter_body(cls, header: dict, reader: asyncio.StreamReader) -> AsyncIterator[bytes]:
         try:
-            address, path, with_ssl = HttpCatProxies._parse_url(url)
-            async with HttpCatProxies(*address, ssl=with_ssl) as req:
-                rsp = await req.send_request("GET", path, conn_timeout=timeout)
-            length = int(rsp.header.get("Content-Length", 0))
-            if length and length != len(rsp.body):
-                raise BufferError(f"Content-Length mismatch: {length} != {len(rsp.body)}")
-            elif rsp.code != 200:
-                raise LookupError(f"Request failed with status {rsp.code}:{rsp.status} {rsp.text()}")
+            if header.get("Transfer-Encoding") == "chunked":
+                while True:
+                    len_hex = await cls._read_line(reader)
+                    if not len_hex:
+                        if header.get("Connection") == "close":
+                            return
+                        raise ConnectionResetError("Connection reset by peer")
+                    length = int(len_hex.split(";", 1)[0], 16)
+                    if not length:
+                        # 读完 trailer 与结尾的空行, 否则残留的 CRLF 会被复用该连接的下一个请求读到
+                        while (await reader.readline()).rstrip(b"\r\n"):
+                            pass
+                        return
+                    while length:
+                        chunk = await reader.readexactly(min(length, DOWNLOAD_CHUNK_SIZE))
+                        length -= len(chunk)
+                        yield chunk
+                    await reader.readline()  # chunk 结尾的 CRLF
+            elif "Content-Length" in header:
+                remain = int(header["Content-Length"])
+                while remain:
+                    chunk = await reader.readexactly(min(remain, DOWNLOAD_CHUNK_SIZE))
+                    remain -= len(chunk)
+                    yield chunk
             else:
-                return rsp.decompressed_body
-        except (asyncio.TimeoutError, BufferError, ConnectionError) as e:
-            logger.error(f"Request failed: {repr(e)}")
-        except ssl.SSLError as e:
-            # Suppress SSL Error
-            # like: [SSL: APPLICATION_DATA_AFTER_CLOSE_NOTIFY] application data after close notify (_ssl.c:2706)
-            logger.error(f"SSL error: {repr(e)}")
-        return await download_resource(url, retry - 1, timeout=timeout)
-    else:
-        raise ConnectionError(f"Request failed after many tries")
+                while chunk := await reader.read(DOWNLOAD_CHUNK_SIZE):
+                    yield chunk
+        except asyncio.IncompleteReadError as e:
+            raise BufferError(f"Content-Length mismatch: got {len(e.partial)} of {e.expected} bytes") from e
+
+    @classmethod
+    async def _stream_body(
+        cls, header: dict, reader: asyncio.StreamReader, sink: BinaryIO, max_size: int
+    ) -> int:
+        encoding = header.get("Content-Encoding")
+        if encoding in ("gzip", "deflate"):
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)  # 自动识别 gzip/zlib 头
+        elif encoding:
+            raise TypeError("Unsuppoted compress type:", encoding)
+        else:
+            decompressor = None
+        size = 0
+
+        def write(chunk: bytes):
+            nonlocal size
+            size += len(chunk)
+            if size > max_size:
+                raise ResourceTooLarge(f"response body exceeds limit {max_size}")
+            sink.write(chunk)
+
+        async for chunk in cls._iter_body(header, reader):
+            if decompressor:
+                # 限制单次解压输出, 避免压缩炸弹
+                write(decompressor.decompress(chunk, max_size - size + 1))
+                if decompressor.unconsumed_tail:
+                    raise ResourceTooLarge(f"response body exceeds limit {max_size}")
+            else:
+                write(chunk)
+        if decompressor:
+            write(decompressor.flush())
+        return size
+
+
+def set_download_max_size(size: int) -> None:
+    global download_max_size
+    download_max_size = size
+
+
+def check_resource_size(size: int) -> None:
+    """下载与本地文件共用同一大小上限"""
+    if size > download_max_size:
+        raise ResourceTooLarge(f"resource size {size} exceeds limit {download_max_size}")
+
+
+async def _download_once(url: str, sink: BinaryIO, max_size: int, timeout: float, max_redirect=10) -> int:
+    for _ in range(max_redirect + 1):
+        address, path, with_ssl = HttpCatProxies._parse_url(url)
+        async with HttpCatProxies(*address, ssl=with_ssl) as req:
+            rsp = await req.stream_request("GET", path, sink, max_size, conn_timeout=timeout)
+        if rsp.code // 100 == 3 and "Location" in rsp.header:
+            url = urljoin(url, rsp.header["Location"])
+            continue
+        elif rsp.code >= 500 or rsp.code == 429:
+            raise ConnectionError(f"Request failed with status {rsp.code}:{rsp.status}")
+        elif rsp.code != 200:
+            raise LookupError(f"Request failed with status {rsp.code}:{rsp.status}")
+        return sink.tell()
+    raise LookupError(f"Too many redirects: {url[:80]}")
+
+
+async def download_to_file(
+    url: str, retry=5, timeout=10, max_size: Optional[int] = None, backoff=0.5, max_backoff=8.0
+) -> BinaryIO:
+    """流式下载到 SpooledTemporaryFile, 失败时按指数退避(full jitter)重试
+
+    返回的文件已 seek(0), 可直接交给上传接口, 由调用方负责关闭
+    """
+    max_size = max_size or download_max_size
+    start = time.perf_counter()
+    for attempt in range(1, retry + 1):
+        buf = SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+        attempt_start = time.perf_counter()
+        try:
+            size = await _download_once(url, buf, max_size, timeout)
+        except (asyncio.TimeoutError, BufferError, ConnectionError, ssl.SSLError) as e:
+            # SSL Error like: [SSL: APPLICATION_DATA_AFTER_CLOSE_NOTIFY] application data after close notify
+            buf.close()
+            logger.error(
+                f"Request failed ({attempt}/{retry}, {time.perf_counter() - attempt_start:.3f}s): {repr(e)}"
+            )
+            if attempt < retry:
+                await asyncio.sleep(random.uniform(0, min(max_backoff, backoff * 2 ** (attempt - 1))))
+            continue
+        except BaseException:
+            buf.close()
+            raise
+        buf.seek(0)
+        logger.debug(
+            f"downloaded {url[:80]}: {size} bytes in {time.perf_counter() - start:.3f}s"
+            f" (last attempt {time.perf_counter() - attempt_start:.3f}s, {attempt} attempt(s))"
+        )
+        return buf
+    raise ConnectionError(f"Request failed after {retry} tries: {url[:80]}")
+
+
+async def download_resource(url: str, retry=5, timeout=10) -> bytes:
+    with await download_to_file(url, retry, timeout) as f:
+        return f.read()
+
+
+class AudioPoolBusy(RuntimeError):
+    pass
+
+
+@dataclass
+class AudioPoolStats:
+    completed: int = 0
+    failed: int = 0
+    rejected: int = 0
+    wait_time: float = 0.0
+    run_time: float = 0.0
+
+
+class AudioWorkerPool:
+    """silk 编解码专用线程池, 等待中与执行中的任务数达到 `max_queue` 时直接拒绝新任务"""
+
+    def __init__(self, workers: int = 2, max_queue: int = 32):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.stats = AudioPoolStats()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._depth = 0
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def configure(self, workers: Optional[int] = None, max_queue: Optional[int] = None) -> None:
+        if workers is not None and workers != self.workers:
+            self.workers = workers
+            self.shutdown()
+        if max_queue is not None:
+            self.max_queue = max_queue
+
+    async def run(self, name: str, func: Callable[..., T], *args, **kwargs) -> T:
+        if self._depth >= self.max_queue:
+            self.stats.rejected += 1
+            raise AudioPoolBusy(f"audio worker pool is full ({self._depth} job(s) queued)")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="nekobox-audio")
+        submitted = time.perf_counter()
+        started = 0.0
+
+        def job() -> T:
+            nonlocal started
+            started = time.perf_counter()
+            return func(*args, **kwargs)
+
+        self._depth += 1
+        try:
+            res = await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        except Exception:
+            self.stats.failed += 1
+            raise
+        finally:
+            self._depth -= 1
+        finished = time.perf_counter()
+        self.stats.completed += 1
+        self.stats.wait_time += started - submitted
+        self.stats.run_time += finished - started
+        logger.debug(
+            f"audio job {name}: wait {(started - submitted) * 1000:.1f}ms, run {(finished - started) * 1000:.1f}ms"
+        )
+        return res
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+audio_pool = AudioWorkerPool()
+
+
+ffmpeg_timeout = 30.0
+_ffmpeg_slots = asyncio.Semaphore(2)
+
+
+def set_ffmpeg_limits(concurrency: Optional[int] = None, timeout: Optional[float] = None) -> None:
+    global _ffmpeg_slots, ffmpeg_timeout
+    if concurrency is not None:
+        _ffmpeg_slots = asyncio.Semaphore(concurrency)
+    if timeout is not None:
+        ffmpeg_timeout = timeout
+
+
+async def _feed_stdin(proc: asyncio.subprocess.Process, source: BinaryIO) -> None:
+    assert proc.stdin
+    try:
+        while chunk := source.read(DOWNLOAD_CHUNK_SIZE):
+            proc.stdin.write(chunk)
+            await proc.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # ffmpeg 提前退出, 以返回码为准
+    finally:
+        proc.stdin.close()
+
+
+async def _ffmpeg_exec(
+    ffmpeg: str, input_path: str, source: Optional[BinaryIO], out_args: List[str]
+) -> bytes:
+    proc = await asyncio.create_subprocess_exec(
+        ffmpeg,
+        *("-hide_banner", "-loglevel", "error", "-i", input_path, *out_args, "pipe:1"),
+        stdin=asyncio.subprocess.PIPE if source else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        feeder = _feed_stdin(proc, source) if source else asyncio.sleep(0)
+        _, out, err = await asyncio.wait_for(
+            asyncio.gather(feeder, proc.stdout.read(), proc.stderr.read()), ffmpeg_timeout  # type: ignore
+        )
+        if await proc.wait() != 0:
+            raise ProcessLookupError(proc.returncode, err.decode(errors="replace")[-200:])
+        return out
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+
+
+async def run_ffmpeg(source: BinaryIO, out_args: List[str]) -> bytes:
+    """通过 stdin/stdout 管道调用 ffmpeg, 同时运行的进程数与单次耗时受限, 超时的进程会被 kill
+
+    部分容器(如 moov 在末尾的 mp4)无法从管道解析, 此时回退为临时输入文件
+    """
+    ffmpeg = which("ffmpeg")
+    if not ffmpeg:
+        raise RuntimeError("ffmpeg not found, transform fail")
+    async with _ffmpeg_slots:
+        try:
+            return await _ffmpeg_exec(ffmpeg, "pipe:0", source, out_args)
+        except ProcessLookupError as e:
+            logger.debug(f"ffmpeg cannot read from pipe, retry with file input: {e.args[-1]!r}")
+        source.seek(0)
+        with NamedTemporaryFile(suffix=".tmp") as f:
+            copyfileobj(source, f)
+            f.flush()
+            return await _ffmpeg_exec(ffmpeg, f.name, None, out_args)
 
 
 async def transform_audio(audio: BinaryIO) -> BinaryIO:
@@ -127,54 +653,25 @@ async def transform_audio(audio: BinaryIO) -> BinaryIO:
 
     if typ:
         return audio
-    elif not typ and async_encode_file:
-        ffmpeg = which("ffmpeg")
-        if not ffmpeg:
-            raise RuntimeError("ffmpeg not found, transform fail")
-
-        with TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, f"{os.urandom(16).hex()}.tmp")
-            with open(input_path, "wb") as f:
-                f.write(audio.read())
-
-            out_path = os.path.join(temp_dir, f"{os.urandom(16).hex()}.tmp")
-            proc = await asyncio.create_subprocess_exec(
-                ffmpeg, "-i", input_path, "-f", "s16le", "-ar", "24000", "-ac", "1", "-y", out_path
-            )
-            if await proc.wait() != 0:
-                raise ProcessLookupError(proc.returncode)
-
-            data = await async_encode_file(out_path)
-        return BytesIO(data)
+    elif not typ and silk_encode:
+        pcm = await run_ffmpeg(audio, ["-f", "s16le", "-ar", "24000", "-ac", "1"])
+        return BytesIO(await audio_pool.run("silk_encode", silk_encode, pcm, sample_rate=24000))
     else:
         raise RuntimeError("module 'pysilk-mod' not install, transform fail")
 
 
 async def decode_audio(typ: AudioType, audio: bytes) -> bytes:
     """audio to wav"""
-    if async_decode and (typ == AudioType.tx_silk or typ == AudioType.silk_v3):
-        return await async_decode(audio, to_wav=True)
-    elif typ == AudioType.amr and (ffmpeg := which("ffmpeg")):
-        with TemporaryDirectory() as temp_dir:
-            input_path = os.path.join(temp_dir, f"{os.urandom(16).hex()}.tmp")
-            with open(input_path, "wb") as f:
-                f.write(audio)
-
-            out_path = os.path.join(temp_dir, f"{os.urandom(16).hex()}.tmp")
-            proc = await asyncio.create_subprocess_exec(
-                ffmpeg, "-i", input_path, "-ab", "12.2k", "-ar", "16000", "-ac", "1", "-y", "-f", "wav", out_path
-            )
-            if await proc.wait() != 0:
-                raise ProcessLookupError(proc.returncode)
-
-            with open(out_path, "rb") as f:
-                return f.read()
+    if silk_decode and (typ == AudioType.tx_silk or typ == AudioType.silk_v3):
+        return await audio_pool.run("silk_decode", silk_decode, audio, to_wav=True)
+    elif typ == AudioType.amr and which("ffmpeg"):
+        return await run_ffmpeg(BytesIO(audio), ["-ab", "12.2k", "-ar", "16000", "-ac", "1", "-f", "wav"])
     raise NotImplementedError(typ)
 
 
 def decode_audio_available(typ: AudioType) -> bool:
     if typ == AudioType.tx_silk or typ == AudioType.silk_v3:
-        if not async_decode:
+        if not silk_decode:
             warnings.warn("module 'pysilk-mod' not install, decode fail")
         else:
             return True
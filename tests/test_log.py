@@ -0,0 +1,41 @@
+import sys
+import traceback
+
+import pytest
+from loguru import logger
+from lagrange import install_loguru
+
+from nekobox.log import patch_logging
+
+
+@pytest.fixture
+def patched(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "excepthook", sys.excepthook)
+    monkeypatch.setattr(traceback, "print_exception", traceback.print_exception)
+    yield
+    logger.remove()
+
+
+def test_patch_logging_after_install_loguru(patched, capsys):
+    # __main__.run 先调用 install_loguru, 其添加的 0 级 sink 必须被移除
+    install_loguru()
+    patch_logging("WARNING")
+    rendered = []
+    logger.opt(lazy=True).info("{}", lambda: rendered.append("info"))
+    logger.opt(lazy=True).warning("{}", lambda: rendered.append("warning") or "shown")
+    assert rendered == ["warning"]
+    assert "shown" in capsys.readouterr().err
+
+
+def test_patch_logging_diagnose(patched, capsys):
+    install_loguru()
+    patch_logging("INFO", diagnose=False)
+    try:
+        value = "sentinel" + "-value"
+        raise ValueError(value[:3])
+    except ValueError:
+        logger.exception("failed")
+    err = capsys.readouterr().err
+    assert "failed" in err
+    assert "sentinel-value" not in err